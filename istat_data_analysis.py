@@ -1,60 +1,109 @@
 # Libraries
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.oxml import OxmlElement
+from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_TABLE_ALIGNMENT
 import os
 from datetime import datetime
+import uuid
+import qap_charts
+import qap_checkpoint
+import qap_ingest
+import qap_limits
+import qap_stats
+import qap_tables
+import qap_templates
 from decimal import Decimal, ROUND_HALF_UP
 
+# Set by the GUI, which then calls run() without arguments
 file_path = ""
 sheet_name = ""
 user_id = ""
+workers = 1
+
+OUTPUT_DIR = r"C:\iCCnet QAP Program\Output\POCT"
+TEMPLATE_PATH = r"C:\iCCnet QAP Program\Source_files\iSTATWordTemplate.docx"
+
+ANALYTES = ['ph', 'pco2', 'po2', 'lac', 'na', 'k', 'ica', 'glu', 'urea', 'creat', 'hct']
+
+analyte_names = {
+    'ph': 'pH',
+    'pco2': 'pCO2',
+    'po2': 'pO2',
+    'lac': 'Lactate',
+    'na': 'Sodium',
+    'k': 'Potassium',
+    'ica': 'Ionised Calcium',
+    'glu': 'Glucose',
+    'urea': 'Urea',
+    'creat': 'Creatinine',
+    'hct': 'Haematocrit'
+}
+
+y_labels = {
+    'ph': '',
+    'pco2': 'mmHg',
+    'po2': 'mmHg',
+    'lac': 'mmol/L',
+    'na': 'mmol/L',
+    'k': 'mmol/L',
+    'ica': 'mmol/L',
+    'glu': 'mmol/L',
+    'urea': 'mmol/L',
+    'creat': 'µmol/L',
+    'hct': '%'
+}
+
+additional_text = {
+    'ph': 'RCPA ALP: +/- 0.04',
+    'pco2': 'RCPA ALP: +/- 2.0 up to 34 mmHg then 6%',
+    'po2': 'RCPA ALP: +/- 5.0 up to 83 mmHg then 6%',
+    'lac': 'RCPA ALP: +/- 0.5 up to 4.0 mmol/L then 12%',
+    'na': 'RCPA ALP: +/- 3.0 up to 150 mmol/L then 2%',
+    'k': 'RCPA ALP: +/- 0.2 up to 4.0 mmol/L then 5%',
+    'ica': 'RCPA ALP: +/- 0.04 up to 1.00 mmol/L then 4%',
+    'glu': 'RCPA ALP: +/- 0.4 up to 5.0 mmol/L then 8%',
+    'urea': 'RCPA ALP: +/- 0.5 up to 4.0 mmol/L then 12%',
+    'creat': 'RCPA ALP: +/- 8.0 up to 100 µmol/L then 8%',
+    'hct': 'RCPA ALP: +/- 4.0 up to 20% then 20%'
+}
+
+ALP_RULES = {
+    'ph': {'absolute': 0.04, 'decimals': 2},
+    'pco2': {'threshold': 34, 'absolute': 2, 'relative': 0.06, 'decimals': 2},
+    'po2': {'threshold': 83, 'absolute': 5, 'relative': 0.06, 'decimals': 2},
+    'lac': {'threshold': 4.0, 'absolute': 0.5, 'relative': 0.12, 'decimals': 2},
+    'na': {'threshold': 150, 'absolute': 3, 'relative': 0.02, 'decimals': 2},
+    'k': {'threshold': 4, 'absolute': 0.2, 'relative': 0.05, 'decimals': 2},
+    'ica': {'threshold': 1, 'absolute': 0.04, 'relative': 0.04, 'decimals': 2},
+    'glu': {'threshold': 5, 'absolute': 0.4, 'relative': 0.08, 'decimals': 2},
+    'urea': {'threshold': 4.0, 'absolute': 0.5, 'relative': 0.12, 'decimals': 2},
+    'creat': {'threshold': 100, 'absolute': 8, 'relative': 0.08, 'decimals': 2},
+    'hct': {'threshold': 20, 'absolute': 4, 'relative': 0.2, 'decimals': 2}
+}
+
+CHART_STYLE = {
+    'grid': (4, 3),
+    'figsize': (30, 30),
+    'pad': 9.5,
+    'h_pad': 14,
+    'point_size': 16,
+    'point_alpha': 0.7,
+    'marker_size': 190,
+    'title_size': 30,
+    'xlabel_size': 35,
+    'ylabel_size': 24,
+    'legend_size': 20,
+    'legend_anchor': (1.08, 0),
+    'note_size': 17,
+    'note_xy': (0, -0.15),
+    'tick_size': 24,
+    'embed_width': 7,
+    'dpi': 200,
+}
 
 
-def replace_text(doc, search_text, replace_text):
-    for paragraph in doc.paragraphs:
-        if search_text in paragraph.text:
-            paragraph.text = paragraph.text.replace(search_text, replace_text)
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if search_text in cell.text:
-                    cell.text = cell.text.replace(search_text, replace_text)
-
-def replace_placeholder_in_footer(doc, placeholder, replacement_text):
-    for section in doc.sections:
-        for paragraph in section.footer.paragraphs:
-            if placeholder in paragraph.text:
-                paragraph.text = paragraph.text.replace(placeholder, replacement_text)
-                for run in paragraph.runs:
-                    if replacement_text in run.text:
-                        run.font.size = Pt(7)
-                        run.font.bold = False
-
-def remove_outliers(data, analytes):
-    cleaned_data = data.copy()
-    for analyte in analytes:
-        Q1 = cleaned_data[analyte].quantile(0.15)
-        Q3 = cleaned_data[analyte].quantile(0.85)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-        cleaned_data = cleaned_data[(cleaned_data[analyte] >= lower_bound) & (cleaned_data[analyte] <= upper_bound)]
-    return cleaned_data
-
-def is_outlier(value, analyte, cleaned_data):
-    Q1 = cleaned_data[analyte].quantile(0.15)
-    Q3 = cleaned_data[analyte].quantile(0.85)
-    IQR = Q3 - Q1
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-    return value < lower_bound or value > upper_bound
-
 def format_value(value, analyte):
     if pd.isna(value):
         return 'No submission'
@@ -83,399 +132,278 @@ def format_value(value, analyte):
     elif analyte == 'creat':
         return f"{value:.0f}"
 
-def run():
-    global file_path, sheet_name, user_id
-
-    if not file_path:
-        raise FileNotFoundError("No file path specified.")
-    if not sheet_name:
-        raise ValueError("No sheet name specified.")
-    if not user_id:
-        raise ValueError("No user ID specified.")
-
-    Database = pd.read_excel(file_path, sheet_name = sheet_name)
-    template_path = r"C:\iCCnet QAP Program\Source_files\iSTATWordTemplate.docx"
-
-    Database.columns = Database.columns.str.strip()
-    analytes = ['ph', 'pco2', 'po2', 'lac', 'na', 'k', 'ica', 'glu', 'urea', 'creat', 'hct']
 
+def chart_panels(analytes, means, limits, Database_cleaned):
+    panels = []
     for analyte in analytes:
-        Database[analyte] = pd.to_numeric(Database[analyte], errors='coerce')
+        other_sites_data = Database_cleaned[analyte].dropna()
 
-    Database_cleaned = remove_outliers(Database, analytes)
-    means = {analyte: float(Decimal(np.mean(Database_cleaned[analyte].dropna())).quantize(Decimal('0.01'), rounding = ROUND_HALF_UP)) for analyte in analytes}
+        jitter_other_sites = np.random.uniform(-0.02, 0.02, len(other_sites_data))
+        x_positions_other_sites = np.linspace(0.9, 1.1, len(other_sites_data)) + jitter_other_sites
 
+        data_min = other_sites_data.min() if not other_sites_data.empty else limits[analyte][0]
+        data_max = other_sites_data.max() if not other_sites_data.empty else limits[analyte][1]
+        data_range = data_max - data_min
 
-    limits = {}
-    for analyte, mean in means.items():
         if analyte == 'ph':
-            ll = mean - 0.04
-            ul = mean + 0.04
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 0.2
         elif analyte == 'pco2':
-            if mean > 34:
-                ll = mean * 0.94
-                ul = mean * 1.06
-            else:
-                ll = mean - 2
-                ul = mean + 2
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 5
         elif analyte == 'po2':
-            if mean > 83:
-                ll = mean * 0.94
-                ul = mean * 1.06
-            else:
-                ll = mean - 5
-                ul = mean + 5
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
-        elif analyte == 'lac':
-            if mean > 4.0:
-                ll = mean * 0.88
-                ul = mean * 1.12
-            else:
-                ll = mean - 0.5
-                ul = mean + 0.5
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 20
         elif analyte == 'na':
-            if mean > 150:
-                ll = mean * 0.98
-                ul = mean * 1.02
-            else:
-                ll = mean - 3
-                ul = mean + 3
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 5
         elif analyte == 'k':
-            if mean > 4:
-                ll = mean * 0.95
-                ul = mean * 1.05
-            else:
-                ll = mean - 0.2
-                ul = mean + 0.2
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 1
         elif analyte == 'ica':
-            if mean > 1:
-                ll = mean * 0.96
-                ul = mean * 1.04
-            else:
-                ll = mean - 0.04
-                ul = mean + 0.04
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 0.2
+        elif analyte == 'hct':
+            padding = 10
         elif analyte == 'glu':
-            if mean > 5:
-                ll = mean * 0.92
-                ul = mean * 1.08
-            else:
-                ll = mean - 0.4
-                ul = mean + 0.4
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 2
+        elif analyte == 'lac':
+            padding = 1
         elif analyte == 'urea':
-            if mean > 4.0:
-                ll = mean * 0.88
-                ul = mean * 1.12
-            else:
-                ll = mean - 0.5
-                ul = mean + 0.5
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
+            padding = 5
         elif analyte == 'creat':
-            if mean > 100:
-                ll = mean * 0.92
-                ul = mean * 1.08
-            else:
-                ll = mean - 8
-                ul = mean + 8
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
-        elif analyte == 'hct':
-            if mean > 20:
-                ll = mean * 0.80
-                ul = mean * 1.2
-            else:
-                ll = mean - 4
-                ul = mean + 4
-            ll_formatted = f"{ll:.2f}"
-            ul_formatted = f"{ul:.2f}"
-
-        limits[analyte] = (ll_formatted, ul_formatted)
-
-    for site in Database['site'].unique():
-        site_data = Database[Database['site'] == site]
-        if site_data.empty:
-            continue
-
-
-        # First page 
-        doc = Document(template_path)
-        today_date = datetime.now().strftime('%d-%m-%Y')
-        replace_text(doc, 'DATE', today_date)
-        replace_text(doc, 'SITE', site)
-        replace_text(doc, 'CYCLE', sheet_name)
-        replace_placeholder_in_footer(doc, 'ISSUER', user_id.title())
-
-        # Second page
-        program_paragraph = doc.add_paragraph()
-        run = program_paragraph.add_run("Program: Blood Gas & Electrolytes")
-        run.bold = True
-        program_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        device_paragraph = doc.add_paragraph()
-        run = device_paragraph.add_run("Device: iSTAT")
-        run.bold = True
-        device_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        site_paragraph = doc.add_paragraph()
-        run = site_paragraph.add_run(site)
-        run.bold = True
-        site_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        sample_paragraph = doc.add_paragraph()
-        run = sample_paragraph.add_run(f"Sample: {sheet_name}")
-        run.bold = True
-        sample_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-
-        table = doc.add_table(rows= 1, cols=7)
-        table.alignment = WD_TABLE_ALIGNMENT.CENTER
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Analyte'
-        hdr_cells[1].text = 'Your Result'
-        hdr_cells[2].text = 'Lower Limit'
-        hdr_cells[3].text = 'Mean'
-        hdr_cells[4].text = 'Upper Limit'
-        hdr_cells[5].text = 'Units'
-        hdr_cells[6].text = 'Interpretation'
+            padding = 50
+        else:
+            padding = data_range * 0.1
+
+        ymin = max(0, data_min - padding)
+        ymax = data_max + padding
+
+        panels.append({
+            'x': x_positions_other_sites,
+            'y': other_sites_data.values,
+            'ylim': (ymin, ymax),
+            'bands': (limits[analyte][0], means[analyte], limits[analyte][1]),
+            'xlabel': analyte_names[analyte],
+            'ylabel': y_labels[analyte],
+            'note': additional_text[analyte],
+        })
+    return panels
+
+
+def render_site(site, interpretation, context):
+    sheet_name = context['sheet_name']
+    user_id = context['user_id']
+    template_path = context['template_path']
+
+    # First page 
+    today_date = datetime.now().strftime('%d-%m-%Y')
+    doc = qap_templates.fill_template(template_path, {
+        'DATE': today_date,
+        'SITE': site,
+        'CYCLE': sheet_name,
+        'ISSUER': user_id.title(),
+    }, fonts = {'ISSUER': {'size': Pt(7), 'bold': False}})
+
+    # Second page
+    program_paragraph = doc.add_paragraph()
+    run = program_paragraph.add_run("Program: Blood Gas & Electrolytes")
+    run.bold = True
+    program_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    device_paragraph = doc.add_paragraph()
+    run = device_paragraph.add_run("Device: iSTAT")
+    run.bold = True
+    device_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    site_paragraph = doc.add_paragraph()
+    run = site_paragraph.add_run(site)
+    run.bold = True
+    site_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    sample_paragraph = doc.add_paragraph()
+    run = sample_paragraph.add_run(f"Sample: {sheet_name}")
+    run.bold = True
+    sample_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+    outlier_present = False
+
+    rows = []
+    for entry in interpretation.itertuples():
+        analyte = entry.Index
+        if pd.isna(entry.result):
+            verdict = 'Unacceptable'
+        else:
+            outlier = entry.verdict != 'Acceptable' and entry.outlier
+            outlier_present = outlier_present or outlier
+            verdict = qap_tables.verdict_cell(entry.verdict, outlier)
+        rows.append([
+            analyte_names[analyte],
+            format_value(entry.result, analyte),
+            format_value(entry.lower_limit, analyte),
+            format_value(entry.consensus, analyte),
+            format_value(entry.upper_limit, analyte),
+            y_labels[analyte],
+            verdict,
+        ])
+
+    header = ['Analyte', 'Your Result', 'Lower Limit', context['consensus_label'], 'Upper Limit', 'Units', 'Interpretation']
+    if context['z_scores']:
+        header, rows = qap_tables.with_z_scores(header, rows, interpretation['z_score'])
+    qap_tables.add_results_table(doc, header, rows, alignment = WD_TABLE_ALIGNMENT.CENTER)
+
+    if outlier_present:
+        spacer_paragraph = doc.add_paragraph()
+        spacer_run = spacer_paragraph.add_run()
+        spacer_run.font.size = Pt(7)
+        outlier_paragraph = doc.add_paragraph()
+        outlier_text = outlier_paragraph.add_run('‡ Outliers are excluded from the statistical analysis and not graphically represented.')
+        outlier_text.font.size = Pt(7)
+        outlier_text.font.bold = False
         
-        for cell in hdr_cells:
-            cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            if not cell.paragraphs[0].runs:
-                cell.paragraphs[0].add_run()
-            run = cell.paragraphs[0].runs[0]
-            run.font.size = Pt(12)
-            run.font.bold = True
-            run.font.color.rgb = RGBColor(255, 255, 255)  # White text
-            shading = OxmlElement('w:shd')
-            shading.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}fill', '800000')  # Dark red
-            cell._element.get_or_add_tcPr().append(shading)
-            
-        analyte_names = {
-            'ph': 'pH',
-            'pco2': 'pCO2',
-            'po2': 'pO2',
-            'lac': 'Lactate',
-            'na': 'Sodium',
-            'k': 'Potassium',
-            'ica': 'Ionised Calcium',
-            'glu': 'Glucose',
-            'urea': 'Urea',
-            'creat': 'Creatinine',
-            'hct': 'Haematocrit'
-        }
-
-        y_labels = {
-            'ph': '',
-            'pco2': 'mmHg',
-            'po2': 'mmHg',
-            'lac': 'mmol/L',
-            'na': 'mmol/L',
-            'k': 'mmol/L',
-            'ica': 'mmol/L',
-            'glu': 'mmol/L',
-            'urea': 'mmol/L',
-            'creat': 'µmol/L',
-            'hct': '%'
-        }
-        
-        outlier_present = False
-
-        for i, analyte in enumerate(analytes):
-            row_cells = table.add_row().cells
-            analyte_run = row_cells[0].paragraphs[0].add_run(analyte_names[analyte])
-            analyte_run.font.bold = True
-            your_result = site_data[analyte].values[0]
-
-            row_cells[1].text = format_value(your_result, analyte)
-            row_cells[2].text = format_value(float(limits[analyte][0]), analyte)
-            row_cells[3].text = format_value(means[analyte], analyte)
-            row_cells[4].text = format_value(float(limits[analyte][1]), analyte)
-            row_cells[5].text = y_labels[analyte]
-
-            if pd.isna(your_result):
-                row_cells[6].text = 'Unacceptable'
-            elif float(limits[analyte][0]) <= your_result <= float(limits[analyte][1]):
-                run = row_cells[6].paragraphs[0].add_run('Acceptable')
-                run.font.color.rgb = RGBColor(0, 128, 0)
-            else:
-                if is_outlier(your_result, analyte, Database):
-                    row_cells[6].text = 'Unacceptable'
-                    run = row_cells[6].paragraphs[0].add_run ('‡')
-                    run.font.superscript = True
-                    run.font.size = Pt(10)
-                    outlier_present = True
-                else:
-                    row_cells[6].text = 'Unacceptable'
-
-                run = row_cells[6].paragraphs[0].runs[0]
-                run.font.color.rgb = RGBColor(255, 0, 0)
-        
-            for cell in row_cells:
-                cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-                if not cell.paragraphs[0].runs:
-                    cell.paragraphs[0].add_run()
-                run = cell.paragraphs[0].runs[0]
-                run.font.size = Pt(10)
-                run.font.color.rgb = RGBColor(0, 0, 0)
-                shading = OxmlElement('w:shd')
-                if i % 2 == 0:
-                    shading.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}fill', 'FCF7EC')
-                else:
-                    shading.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}fill', 'FFFFFF')
-                cell._element.get_or_add_tcPr().append(shading)
-
-        if outlier_present:
-            spacer_paragraph = doc.add_paragraph()
-            spacer_run = spacer_paragraph.add_run()
-            spacer_run.font.size = Pt(7)
-            outlier_paragraph = doc.add_paragraph()
-            outlier_text = outlier_paragraph.add_run('‡ Outliers are excluded from the statistical analysis and not graphically represented.')
-            outlier_text.font.size = Pt(7)
-            outlier_text.font.bold = False
-            
-
-        doc.add_page_break()
-
-        # Third page
-        program_paragraph = doc.add_paragraph()
-        run = program_paragraph.add_run("Program: Blood Gas & Electrolytes")
-        run.bold = True
-        program_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        device_paragraph = doc.add_paragraph()
-        run = device_paragraph.add_run("Device: iSTAT")
-        run.bold = True
-        device_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        site_paragraph = doc.add_paragraph()
-        run = site_paragraph.add_run(site)
-        run.bold = True
-        site_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        sample_paragraph = doc.add_paragraph()
-        run = sample_paragraph.add_run(f"Sample: {sheet_name}")
-        run.bold = True
-        sample_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-
-        fig, axes = plt.subplots(4, 3, figsize = (30, 30))
-        fig.tight_layout(pad = 9.5, h_pad = 14)
-        axes = axes.flatten()
-
-        for idx, analyte in enumerate(analytes):
-            ax = axes[idx]
-
-            other_sites_data = Database_cleaned[analyte].dropna()
-            your_result = site_data[analyte].values[0]
-
-            jitter_other_sites = np.random.uniform(-0.02, 0.02, len(other_sites_data))
-            jitter_your_result = np.random.uniform(-0.02, 0.02, 1) 
-
-            x_positions_other_sites = np.linspace(0.9, 1.1, len(other_sites_data)) + jitter_other_sites
-            x_position_your_result = 1 + jitter_your_result
-
-            ax.plot(x_positions_other_sites, other_sites_data, 'o', color = 'black', label = "Other sites", markersize = 16, alpha = 0.7)
-
-            ax.scatter(x_position_your_result, your_result, color = 'fuchsia', marker = 's', label = 'Your result', s = 190, zorder = 2)
-            
-            data_min = other_sites_data.min() if not other_sites_data.empty else your_result
-            data_max = other_sites_data.max() if not other_sites_data.empty else your_result
-            data_range = data_max - data_min
-
-            if analyte == 'ph':
-                padding = 0.2
-            elif analyte == 'pco2':
-                padding = 5
-            elif analyte == 'po2':
-                padding = 20
-            elif analyte == 'na':
-                padding = 5
-            elif analyte == 'k':
-                padding = 1
-            elif analyte == 'ica':
-                padding = 0.2
-            elif analyte == 'hct':
-                padding = 10
-            elif analyte == 'glu':
-                padding = 2
-            elif analyte == 'lac':
-                padding = 1
-            elif analyte == 'urea':
-                padding = 5
-            elif analyte == 'creat':
-                padding = 50
-            else:
-                padding = data_range * 0.1
-
-            ymin = max(0, data_min - padding)
-            ymax = data_max + padding
-
-            ax.set_ylim(ymin, ymax)
-
-
-            ax.axhspan(float(limits[analyte][0]), means[analyte], color = 'green', alpha = 0.2, zorder = 0)
-            ax.axhspan(means[analyte], float(limits[analyte][1]), color = 'green', alpha = 0.2, zorder = 0)
-
-            if float(limits[analyte][0]) <= your_result <= float(limits[analyte][1]):
-                ax.set_title('Acceptable', fontsize = 30, fontweight = 'bold', color = 'green')
-            else:
-                ax.set_title('Unacceptable', fontsize = 30, fontweight = 'bold', color = 'red')
-
-            ax.set_xlabel(analyte_names[analyte], fontsize = 35, fontweight = 'bold', loc = 'left')
-            ax.set_ylabel(y_labels[analyte], fontsize = 24)
-            ax.legend(loc = 'upper right', bbox_to_anchor = (1.08, 0), fontsize = 20)
-
-            additional_text = {
-                'ph': 'RCPA ALP: +/- 0.04',
-                'pco2': 'RCPA ALP: +/- 2.0 up to 34 mmHg then 6%',
-                'po2': 'RCPA ALP: +/- 5.0 up to 83 mmHg then 6%',
-                'lac': 'RCPA ALP: +/- 0.5 up to 4.0 mmol/L then 12%',
-                'na': 'RCPA ALP: +/- 3.0 up to 150 mmol/L then 2%',
-                'k': 'RCPA ALP: +/- 0.2 up to 4.0 mmol/L then 5%',
-                'ica': 'RCPA ALP: +/- 0.04 up to 1.00 mmol/L then 4%',
-                'glu': 'RCPA ALP: +/- 0.4 up to 5.0 mmol/L then 8%',
-                'urea': 'RCPA ALP: +/- 0.5 up to 4.0 mmol/L then 12%',
-                'creat': 'RCPA ALP: +/- 8.0 up to 100 µmol/L then 8%',
-                'hct': 'RCPA ALP: +/- 4.0 up to 20% then 20%'
-            }
-
-            ax.annotate(additional_text[analyte], xy = (0, -0.15), xycoords = 'axes fraction', fontsize = 17, ha = 'left')
-            ax.set_xticks([])
-            ax.tick_params(axis = 'y', labelsize = 24)
-
-        # Remove unused axes
-        if len(analytes) < len(axes):
-            for j in range(len(analytes), len(axes)):
-                fig.delaxes(axes[j])
-
-
-        plot_filename = f'{site}_combined.png'
-        plt.savefig(plot_filename, bbox_inches = 'tight')
-        plt.close()
-
-        graph_table = doc.add_table(rows = 1, cols = 1)
-        graph_table.alignment = WD_TABLE_ALIGNMENT.LEFT
-        cell = graph_table.cell(0, 0)
-        paragraph = cell.paragraphs[0]
-        run = paragraph.add_run()
-        run.add_picture(plot_filename, width = Inches(7))
-
-        os.remove(plot_filename)
-
-        output_path = f'C:\\iCCnet QAP Program\\Output\POCT\\iSTAT_{site}_{sheet_name}_{today_date}.docx'
-        doc.save(output_path)
\ No newline at end of file
+
+    doc.add_page_break()
+
+    # Third page
+    program_paragraph = doc.add_paragraph()
+    run = program_paragraph.add_run("Program: Blood Gas & Electrolytes")
+    run.bold = True
+    program_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    device_paragraph = doc.add_paragraph()
+    run = device_paragraph.add_run("Device: iSTAT")
+    run.bold = True
+    device_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    site_paragraph = doc.add_paragraph()
+    run = site_paragraph.add_run(site)
+    run.bold = True
+    site_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    sample_paragraph = doc.add_paragraph()
+    run = sample_paragraph.add_run(f"Sample: {sheet_name}")
+    run.bold = True
+    sample_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+    markers = []
+    for entry in interpretation.itertuples():
+        x_position_your_result = 1 + np.random.uniform(-0.02, 0.02)
+        markers.append((x_position_your_result, entry.result, entry.verdict == 'Acceptable'))
+
+    chart = qap_charts.site_chart(context['cycle_key'], context['chart_panels'], CHART_STYLE, markers)
+
+    graph_table = doc.add_table(rows = 1, cols = 1)
+    graph_table.alignment = WD_TABLE_ALIGNMENT.LEFT
+    cell = graph_table.cell(0, 0)
+    paragraph = cell.paragraphs[0]
+    run = paragraph.add_run()
+    run.add_picture(chart, width = Inches(CHART_STYLE['embed_width']))
+
+    output_path = os.path.join(context['output_dir'], f"iSTAT_{site}_{sheet_name}_{today_date}.docx")
+    doc.save(output_path)
+
+    return output_path
+
+
+def prepare(file_path, sheet_name, user_id, output_dir = OUTPUT_DIR, template_path = TEMPLATE_PATH, consensus = None, exclusion = None, z_scores = None):
+    """Read and judge one cycle sheet.
+
+    Returns (sites, context, report): the per-site interpretations and the
+    cycle context for render_site, and the report entries of the cycle.
+    consensus, exclusion and z_scores left as None fall back to
+    qap_stats.consensus_method, qap_stats.exclusion_mode and
+    qap_tables.show_z_scores.
+    """
+    if not file_path:
+        raise FileNotFoundError("No file path specified.")
+    if not sheet_name:
+        raise ValueError("No sheet name specified.")
+    if not user_id:
+        raise ValueError("No user ID specified.")
+    consensus = qap_stats.consensus_method if consensus is None else consensus
+    exclusion = qap_stats.exclusion_mode if exclusion is None else exclusion
+    z_scores = qap_tables.show_z_scores if z_scores is None else z_scores
+    if consensus not in qap_stats.CONSENSUS_METHODS:
+        raise ValueError(f"Unknown consensus method: {consensus}")
+
+    analytes = list(ANALYTES)
+    Database = qap_ingest.read_results(file_path, sheet_name, analytes, cache_dir = qap_ingest.cache_dir_for(output_dir))
+
+    Database_cleaned = qap_stats.remove_outliers(Database, analytes, exclusion)
+    outlier_bounds = qap_stats.outlier_bounds(Database, analytes)
+    robust_statistics = qap_stats.algorithm_a(Database, analytes)
+    if consensus == 'algorithm_a':
+        means = {analyte: float(Decimal(robust_statistics[analyte]['mean']).quantize(Decimal('0.01'), rounding = ROUND_HALF_UP)) for analyte in analytes}
+        consensus_label = qap_stats.ALGORITHM_A_LABEL
+    else:
+        means = {analyte: float(Decimal(np.mean(Database_cleaned[analyte].dropna())).quantize(Decimal('0.01'), rounding = ROUND_HALF_UP)) for analyte in analytes}
+        consensus_label = 'Mean'
+
+
+    limits = qap_limits.alp_limits(ALP_RULES, means)
+
+    site_rows, duplicate_sites = qap_stats.site_rows(Database)
+    results = site_rows[analytes]
+    interpretation = qap_stats.interpretation_matrix(
+        results,
+        means,
+        {analyte: limits[analyte][0] for analyte in analytes},
+        {analyte: limits[analyte][1] for analyte in analytes},
+        outlier_bounds,
+        robust_statistics = robust_statistics,
+    )
+
+    context = {
+        'cycle_key': uuid.uuid4().hex,
+        'chart_panels': chart_panels(analytes, means, limits, Database_cleaned),
+        'sheet_name': sheet_name,
+        'user_id': user_id,
+        'template_path': template_path,
+        'output_dir': output_dir,
+        'consensus_label': consensus_label,
+        'z_scores': z_scores,
+    }
+
+    sites = qap_stats.site_interpretations(interpretation)
+
+    report = {
+        'outlier_bounds': outlier_bounds,
+        'robust_statistics': robust_statistics,
+        'interpretation': interpretation,
+        'duplicate_sites': duplicate_sites,
+    }
+    return sites, context, report
+
+
+def run(file_path = None, sheet_name = None, user_id = None, output_dir = OUTPUT_DIR, template_path = TEMPLATE_PATH, workers = None, incremental = False, resume = False, checkpoint = False, consensus = None, exclusion = None, z_scores = None):
+    """Generate the reports of every site in one cycle sheet.
+
+    Arguments left as None fall back to the module globals of the same name.
+    Returns a dict with the rendered 'outputs', the per-site 'errors' and the
+    cycle's interpretation. incremental = True renders only the sites whose
+    report inputs changed since the last run (see qap_manifest); checkpoint =
+    True records the run's progress and resume = True carries on from where
+    an interrupted run stopped (see qap_checkpoint).
+    consensus, exclusion and z_scores are passed on to prepare().
+    """
+    settings = globals()
+    consensus = qap_stats.consensus_method if consensus is None else consensus
+    exclusion = qap_stats.exclusion_mode if exclusion is None else exclusion
+    z_scores = qap_tables.show_z_scores if z_scores is None else z_scores
+    sheet_name = settings['sheet_name'] if sheet_name is None else sheet_name
+    inputs = (
+        settings['file_path'] if file_path is None else file_path,
+        sheet_name,
+        settings['user_id'] if user_id is None else user_id,
+        output_dir,
+        template_path,
+        consensus,
+        exclusion,
+        z_scores,
+    )
+    return qap_checkpoint.run_cycle(
+        render_site,
+        prepare,
+        inputs,
+        qap_checkpoint.checkpoint_path(render_site, output_dir, sheet_name),
+        workers = settings['workers'] if workers is None else workers,
+        incremental = incremental,
+        resume = resume,
+        checkpoint = checkpoint,
+    )
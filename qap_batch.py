@@ -0,0 +1,160 @@
+import contextlib
+import csv
+import importlib
+import os
+import time
+from datetime import datetime
+import qap_ingest
+import qap_pool
+
+SUMMARY_FIELDS = ['sheet', 'sites', 'failed', 'duplicate_sites', 'warning_signals', 'action_signals', 'seconds', 'error']
+
+# ISO 13528 signals: a result with 2 < |z| < 3 is questionable and one with
+# |z| >= 3 needs action
+WARNING_Z = 2
+ACTION_Z = 3
+
+PROGRAMS = {
+    'epoc': 'epoc_data_analysis',
+    'istat': 'istat_data_analysis',
+    'lipids': 'lipids_data_analysis',
+    'wbcdiff': 'wbcdiff_data_analysis',
+}
+
+
+def z_signals(interpretation):
+    """Count the (warning, action) signals among the cycle's z-scores."""
+    if 'z_score' not in interpretation:
+        return 0, 0
+    z = interpretation['z_score'].abs()
+    return int(((z > WARNING_Z) & (z < ACTION_Z)).sum()), int((z >= ACTION_Z).sum())
+
+
+def program_module(program):
+    """Accept a program module or its short name, e.g. 'epoc'."""
+    if isinstance(program, str):
+        return importlib.import_module(PROGRAMS[program])
+    return program
+
+
+def run_workbook(program, file_path, user_id, sheets = None, summary_path = None, **options):
+    """Run one program over several cycle sheets of a workbook.
+
+    `program` is a program module (e.g. epoc_data_analysis) and `sheets` a
+    list of sheet names, or None for every sheet in the workbook. The workbook
+    is opened once and all cycles render in this process, so templates and
+    chart state stay warm between sheets. A sheet that cannot be processed is
+    recorded in the summary and the batch moves on. Other keyword arguments
+    (output_dir, template_path, workers, consensus, exclusion, z_scores, ...)
+    are passed on to program.run().
+
+    Returns {sheet: report} and writes one summary row per sheet to a CSV,
+    by default next to the reports in the run's output_dir.
+    """
+    reports = {}
+    summary = []
+    with qap_ingest.open_workbook(file_path) as workbook:
+        if sheets is None:
+            sheets = workbook.sheet_names
+        for sheet in sheets:
+            started = time.perf_counter()
+            row = {'sheet': sheet, 'sites': 0, 'failed': 0, 'duplicate_sites': 0, 'warning_signals': 0, 'action_signals': 0, 'error': ''}
+            try:
+                report = program.run(file_path, sheet, user_id, **options)
+            except Exception as e:
+                print(f"Failed sheet: {sheet}: {type(e).__name__}: {e}")
+                row['error'] = f"{type(e).__name__}: {e}"
+            else:
+                reports[sheet] = report
+                row['sites'] = len(report['outputs'])
+                row['failed'] = len(report['errors'])
+                row['duplicate_sites'] = len(report['duplicate_sites'])
+                for site, count in report['duplicate_sites'].items():
+                    print(f"Duplicate site: {site} has {count} rows, only one is reported")
+                row['warning_signals'], row['action_signals'] = z_signals(report['interpretation'])
+            row['seconds'] = round(time.perf_counter() - started, 2)
+            print(f"Sheet {sheet}: {row['sites']} sites, {row['failed']} failed in {row['seconds']} s")
+            summary.append(row)
+
+    if summary_path is None:
+        workbook_name = os.path.splitext(os.path.basename(file_path))[0]
+        today_date = datetime.now().strftime('%d-%m-%Y')
+        program_name = program.__name__.split('_')[0]
+        summary_dir = options.get('output_dir', program.OUTPUT_DIR)
+        summary_path = os.path.join(summary_dir, f"Batch_{program_name}_{workbook_name}_{today_date}.csv")
+    with open(summary_path, 'w', newline = '') as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames = SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summary)
+
+    return reports
+
+
+def run_jobs(jobs, workers = None, **options):
+    """Run (program, workbook, sheet, issuer) jobs on one shared worker pool.
+
+    Every job is read and judged here first, opening each workbook once
+    however many jobs use it. The sites of all jobs then go to a single
+    process pool, largest jobs first, so workers move on to whichever program
+    still has sites left instead of idling at the end of each run. workers
+    follows qap_pool: 1 renders in this process, 0 or None uses every core.
+    Other keyword arguments (consensus, exclusion, z_scores) are passed on to
+    every job's program.prepare().
+
+    Returns {'jobs': {job: report}, 'sites', 'failed', 'seconds',
+    'sites_per_second'}. A job that cannot be read gets {'error': message}
+    as its report. Reports are keyed by job, so a job given twice raises
+    ValueError.
+    """
+    duplicates = sorted({job for job in jobs if jobs.count(job) > 1}, key = jobs.index)
+    if duplicates:
+        raise ValueError(f"Duplicate jobs: {duplicates}")
+    started = time.perf_counter()
+    reports = {}
+    prepared = []
+    with contextlib.ExitStack() as workbooks:
+        opened = set()
+        for job in jobs:
+            program, file_path, sheet, user_id = job
+            try:
+                program = program_module(program)
+                if os.path.abspath(file_path) not in opened:
+                    workbooks.enter_context(qap_ingest.open_workbook(file_path))
+                    opened.add(os.path.abspath(file_path))
+                sites, context, report = program.prepare(file_path, sheet, user_id, **options)
+            except Exception as e:
+                print(f"Failed job: {job}: {type(e).__name__}: {e}")
+                reports[job] = {'error': f"{type(e).__name__}: {e}"}
+                continue
+            prepared.append((job, program, sites, context, report))
+
+    # Longest first: every site draws one panel per analyte
+    prepared.sort(key = lambda entry: len(entry[2]) * len(entry[3]['chart_panels']), reverse = True)
+
+    if qap_pool.worker_count(workers) == 1:
+        results = [[qap_pool.render_one(program.render_site, site, site_data, context) for site, site_data in sites]
+                   for _, program, sites, context, _ in prepared]
+    else:
+        with qap_pool.open_pool(workers) as executor:
+            futures = [[qap_pool.submit_site(executor, program.render_site, site, site_data, context) for site, site_data in sites]
+                       for _, program, sites, context, _ in prepared]
+            results = [qap_pool.collect_results(job_futures) for job_futures in futures]
+
+    rendered = 0
+    failed = 0
+    for (job, _, sites, _, report), job_results in zip(prepared, results):
+        reports[job] = {**qap_pool.site_report(sites, job_results), **report}
+        rendered += len(reports[job]['outputs'])
+        failed += len(reports[job]['errors'])
+
+    seconds = time.perf_counter() - started
+    sites_per_second = rendered / seconds if seconds else 0.0
+    print(f"{len(prepared)} of {len(jobs)} jobs: {rendered} sites, {failed} failed in {seconds:.1f} s ({sites_per_second:.2f} sites/s)")
+
+    return {
+        'jobs': {job: reports[job] for job in jobs if job in reports},
+        'sites': rendered,
+        'failed': failed,
+        'seconds': round(seconds, 2),
+        'sites_per_second': round(sites_per_second, 2),
+    }
@@ -0,0 +1,164 @@
+import io
+import threading
+import numpy as np
+
+# matplotlib is imported on first use: loading it and its font cache is most
+# of a cold start, and validation-only runs never draw a chart
+
+# Backgrounds are full-page rasters, so only keep the most recent few cycles
+# per thread
+MAX_CACHED_CYCLES = 4
+
+# Figures are plain Figure objects on their own Agg canvas, never registered
+# with pyplot, so any number of threads can draw at once. Each site blits
+# onto its cycle's canvas, so every thread keeps its own cache of them.
+_local = threading.local()
+
+
+def _charts():
+    if not hasattr(_local, 'charts'):
+        _local.charts = {}
+    return _local.charts
+
+
+def _build_chart(panels, style):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize = style['figsize'])
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(*style['grid'])
+    fig.tight_layout(pad = style['pad'], h_pad = style['h_pad'])
+    axes = axes.flatten()
+
+    overlays = []
+    for ax, panel in zip(axes, panels):
+        ax.plot(panel['x'], panel['y'], 'o', color = 'black', label = "Other sites", markersize = style['point_size'], alpha = style['point_alpha'])
+        if len(panel['y']) == 0:
+            ax.set_xlim(0.9, 1.1)
+        marker = ax.scatter([], [], color = 'fuchsia', marker = 's', label = 'Your result', s = style['marker_size'], zorder = 2)
+
+        ax.set_ylim(*panel['ylim'])
+        lower_limit, centre, upper_limit = panel['bands']
+        ax.axhspan(lower_limit, centre, color = 'green', alpha = 0.2, zorder = 0)
+        ax.axhspan(centre, upper_limit, color = 'green', alpha = 0.2, zorder = 0)
+
+        # Lay the page out with the wider of the two titles in place
+        title = ax.set_title('Unacceptable', fontsize = style['title_size'], fontweight = 'bold', color = 'red')
+
+        ax.set_xlabel(panel['xlabel'], fontsize = panel.get('xlabel_size', style['xlabel_size']), fontweight = 'bold', loc = 'left')
+        ax.set_ylabel(panel['ylabel'], fontsize = panel.get('ylabel_size', style['ylabel_size']))
+        ax.legend(loc = 'upper right', bbox_to_anchor = style['legend_anchor'], fontsize = style['legend_size'])
+        ax.annotate(panel['note'], xy = style['note_xy'], xycoords = 'axes fraction', fontsize = style['note_size'], ha = 'left')
+        ax.set_xticks([])
+        ax.tick_params(axis = 'y', labelsize = style['tick_size'])
+        overlays.append((ax, marker, title))
+
+    for ax in axes[len(panels):]:
+        fig.delaxes(ax)
+
+    canvas = fig.canvas
+    renderer = canvas.get_renderer()
+    # Styles are designed on a large canvas; rasterise it at whatever DPI
+    # makes the cropped chart exactly embed_width inches at the profile's DPI,
+    # so fonts, markers and lines all shrink in proportion
+    design_width = fig.get_tightbbox(renderer).padded(0.1).width
+    fig.set_dpi(style['dpi'] * style['embed_width'] / design_width)
+
+    canvas.draw()
+    renderer = canvas.get_renderer()
+    # Same crop as savefig(bbox_inches = 'tight') with the default 0.1 inch pad
+    crop = fig.get_tightbbox(renderer).padded(0.1).transformed(fig.dpi_scale_trans)
+
+    # Axes re-place their titles on every full draw, and place hidden ones
+    # badly, so pin the positions found with the titles showing
+    positions = [title.get_position() for ax, marker, title in overlays]
+    for ax, marker, title in overlays:
+        title.set_visible(False)
+    canvas.draw()
+    for (ax, marker, title), position in zip(overlays, positions):
+        title.set_position(position)
+
+    return {
+        'figure': fig,
+        'background': canvas.copy_from_bbox(fig.bbox),
+        'overlays': overlays,
+        'crop': crop,
+    }
+
+
+def _crop(image, crop):
+    # The tight box can reach past the canvas (e.g. a legend anchored outside
+    # the last column); pad with white like savefig would
+    height, width = image.shape[:2]
+    top = int(round(height - crop.y1))
+    bottom = int(round(height - crop.y0))
+    left = int(round(crop.x0))
+    right = int(round(crop.x1))
+    if top >= 0 and left >= 0 and bottom <= height and right <= width:
+        return image[top:bottom, left:right]
+
+    cropped = np.full((bottom - top, right - left, image.shape[2]), 255, dtype = image.dtype)
+    src_top, src_left = max(top, 0), max(left, 0)
+    src_bottom, src_right = min(bottom, height), min(right, width)
+    cropped[src_top - top:src_bottom - top, src_left - left:src_right - left] = image[src_top:src_bottom, src_left:src_right]
+    return cropped
+
+
+def cycle_chart(cycle_key, panels, style):
+    """Return the cached background for a cycle, drawing it on first use.
+
+    Everything that is the same for every site of a cycle (other sites'
+    results, limits, labels, legend and notes) is drawn once; only the site's
+    marker and the Acceptable/Unacceptable titles are drawn per site.
+    """
+    charts = _charts()
+    chart = charts.get(cycle_key)
+    if chart is None:
+        while len(charts) >= MAX_CACHED_CYCLES:
+            release_chart(next(iter(charts)))
+        chart = _build_chart(panels, style)
+        charts[cycle_key] = chart
+    return chart
+
+
+def release_chart(cycle_key):
+    """Free this thread's cached figure for a cycle."""
+    chart = _charts().pop(cycle_key, None)
+    if chart is not None:
+        # Clearing breaks the figure's reference cycles, so its buffers go
+        # now rather than at the next garbage collection
+        chart['figure'].clear()
+
+
+def site_chart(cycle_key, panels, style, markers):
+    """Render one site's chart as an in-memory PNG.
+
+    `markers` holds an (x, result, acceptable) tuple per panel.
+    """
+    import matplotlib.image
+
+    chart = cycle_chart(cycle_key, panels, style)
+    fig = chart['figure']
+    canvas = fig.canvas
+    canvas.restore_region(chart['background'])
+
+    for (ax, marker, title), (x, result, acceptable) in zip(chart['overlays'], markers):
+        marker.set_offsets([[x, result]])
+        if acceptable:
+            title.set_text('Acceptable')
+            title.set_color('green')
+        else:
+            title.set_text('Unacceptable')
+            title.set_color('red')
+        title.set_visible(True)
+        ax.draw_artist(marker)
+        ax.draw_artist(title)
+        title.set_visible(False)
+
+    image = _crop(np.asarray(canvas.buffer_rgba()), chart['crop'])
+
+    png = io.BytesIO()
+    matplotlib.image.imsave(png, image, format = 'png', dpi = style['dpi'])
+    png.seek(0)
+    return png
@@ -0,0 +1,138 @@
+import json
+import os
+import pickle
+import uuid
+import qap_manifest
+import qap_pool
+
+# A run with checkpoint = True keeps a checkpoint per program and cycle sheet
+# next to the reports, so a run that dies part way can be resumed:
+#
+#   Checkpoint_<program>_<sheet>.pkl      the prepared cycle: sites, context
+#                                          and interpretation, and the
+#                                          workbook it was read from
+#   Checkpoint_<program>_<sheet>.journal  one JSON line per rendered site
+#
+# The state is written under a temporary name and renamed into place, and
+# each journal line is flushed to disk before the next site is recorded, so
+# a crash loses at most the site being written. A resumed run renders only
+# the sites missing from the journal, using the saved cycle statistics. Both
+# files are removed once every site has rendered. Sites are journaled by
+# str(site), as the site ids read from a workbook may be numpy integers.
+
+
+def checkpoint_path(render_site, output_dir, sheet_name):
+    """The checkpoint's path without its extension."""
+    program = render_site.__module__.split('_')[0]
+    return os.path.join(output_dir, f"Checkpoint_{program}_{sheet_name}")
+
+
+def _workbook_stamp(file_path):
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size
+
+
+def save_state(path, inputs, sites, context, report):
+    state = {'inputs': inputs, 'workbook': _workbook_stamp(inputs[0]), 'sites': sites, 'context': context, 'report': report}
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'wb') as f:
+        pickle.dump(state, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, f"{path}.pkl")
+    # A fresh cycle starts an empty journal
+    open(f"{path}.journal", 'w').close()
+
+
+def load_state(path, inputs):
+    """The saved state, or None if there is none or it no longer matches
+    the run's inputs or the workbook on disk."""
+    try:
+        with open(f"{path}.pkl", 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        print(f"No checkpoint at {path}.pkl, starting from the beginning")
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        print(f"Ignoring unreadable checkpoint {path}.pkl: {e}")
+        return None
+
+    if state['inputs'] != inputs:
+        print(f"Checkpoint {path}.pkl was made with other settings, starting from the beginning")
+        return None
+    try:
+        stamp = _workbook_stamp(inputs[0])
+    except OSError:
+        stamp = None
+    if state['workbook'] != stamp:
+        print(f"{inputs[0]} changed since the checkpoint, starting from the beginning")
+        return None
+    return state
+
+
+def load_journal(path):
+    """{str(site): output path} of the sites recorded as rendered."""
+    done = {}
+    try:
+        with open(f"{path}.journal", encoding = 'utf-8') as f:
+            for line in f:
+                try:
+                    site, output_path = json.loads(line)
+                except ValueError:
+                    # A line torn by the crash
+                    continue
+                done[site] = output_path
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def _journal_writer(journal):
+    def record(site, output_path, error):
+        if error is None:
+            journal.write(json.dumps([str(site), output_path]) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+    return record
+
+
+def remove(path):
+    for extension in ('.pkl', '.journal'):
+        try:
+            os.remove(f"{path}{extension}")
+        except FileNotFoundError:
+            pass
+
+
+def run_cycle(render_site, prepare, inputs, path, workers = 1, incremental = False, resume = False, checkpoint = False):
+    """prepare(*inputs) a cycle and render its sites, under a checkpoint if
+    `checkpoint` or `resume` is set.
+
+    resume = True reuses the checkpoint at `path` if it matches `inputs` and
+    the workbook is unchanged, rendering only the sites not yet done (or
+    whose report has gone missing). Returns what run() returns.
+    """
+    state = load_state(path, inputs) if resume else None
+    done = {}
+    if state is None:
+        sites, context, report = prepare(*inputs)
+        if checkpoint or resume:
+            save_state(path, inputs, sites, context, report)
+    else:
+        sites, context, report = state['sites'], state['context'], state['report']
+        done = {site: output_path for site, output_path in load_journal(path).items() if os.path.exists(output_path)}
+        print(f"Resuming {inputs[1]}: {len(done)} of {len(sites)} sites already rendered")
+
+    pending = [(site, site_data) for site, site_data in sites if str(site) not in done]
+    render = qap_manifest.render_changed if incremental else qap_pool.render_sites
+    if not (checkpoint or resume):
+        return {**render(render_site, pending, context, workers = workers), **report}
+
+    with open(f"{path}.journal", 'a', encoding = 'utf-8') as journal:
+        rendered = render(render_site, pending, context, workers = workers, on_result = _journal_writer(journal))
+
+    # Report every site of the cycle in site order, whichever run rendered it
+    outputs = dict(done)
+    outputs.update((str(site), output_path) for site, output_path in rendered['outputs'])
+    rendered['outputs'] = [(site, outputs[str(site)]) for site, _ in sites if str(site) in outputs]
+    if not rendered['errors']:
+        remove(path)
+    return {**rendered, **report}
@@ -0,0 +1,113 @@
+"""Generate QAP reports from the command line, without the GUI.
+
+    python qap_cli.py epoc Results.xlsx --sheet C1 --issuer "jane doe"
+    python qap_cli.py wbcdiff Results.xlsx --validate-only
+
+Without --sheet every sheet of the workbook is processed. --validate-only
+reads and checks the sheets without rendering anything.
+"""
+import argparse
+import os
+import sys
+
+# Same names as qap_batch.PROGRAMS; importing it here would load pandas
+# before the arguments are even parsed
+PROGRAMS = ('epoc', 'istat', 'lipids', 'wbcdiff')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description = "Generate QAP reports without the GUI.")
+    parser.add_argument('program', choices = PROGRAMS)
+    parser.add_argument('workbook')
+    parser.add_argument('--sheet', action = 'append', dest = 'sheets', help = "cycle sheet to process, repeat for several (default: every sheet)")
+    parser.add_argument('--issuer', help = "name printed as the issuer of the reports")
+    parser.add_argument('--output-dir', help = "where to write the reports and the batch summary")
+    parser.add_argument('--template', help = "Word template to fill instead of the program's own")
+    parser.add_argument('--workers', type = int, default = 1, help = "render processes, 0 for one per core (default: 1)")
+    parser.add_argument('--incremental', action = 'store_true', help = "only render sites whose report inputs changed since the last run")
+    parser.add_argument('--checkpoint', action = 'store_true', help = "record each sheet's progress so an interrupted run can be resumed")
+    parser.add_argument('--resume', action = 'store_true', help = "carry on from where an interrupted run of each sheet stopped")
+    parser.add_argument('--exclusion', choices = ('cascade', 'independent'), help = "how outliers are left out of the consensus (default: cascade)")
+    parser.add_argument('--consensus', choices = ('program', 'algorithm_a'), help = "the program's own median or mean, or the ISO 13528 Algorithm A robust mean (default: program)")
+    parser.add_argument('--z-scores', action = 'store_true', default = None, help = "add each result's z-score to the results table")
+    parser.add_argument('--no-cache', action = 'store_true', help = "parse the workbook even if the sheet is cached")
+    parser.add_argument('--validate-only', action = 'store_true', help = "check the sheets and exit without rendering")
+    args = parser.parse_args(argv)
+    if not args.validate_only and not args.issuer:
+        parser.error("--issuer is required unless --validate-only is given")
+    return args
+
+
+def validate(program, file_path, sheets = None, output_dir = None):
+    """Read and check each sheet; return the number that cannot be used.
+
+    Sheets already in the output directory's cache are read from it, but
+    nothing is added to the cache.
+    """
+    import qap_ingest
+    import qap_stats
+
+    problems = 0
+    with qap_ingest.open_workbook(file_path) as workbook:
+        for sheet in sheets or workbook.sheet_names:
+            try:
+                Database = qap_ingest.read_results(file_path, sheet, program.ANALYTES, cache_dir = qap_ingest.cache_dir_for(output_dir or program.OUTPUT_DIR), store = False)
+            except Exception as e:
+                print(f"Sheet {sheet}: {type(e).__name__}: {e}")
+                problems += 1
+                continue
+            site_rows, duplicate_sites = qap_stats.site_rows(Database)
+            blank = int(Database[program.ANALYTES].isna().sum().sum())
+            print(f"Sheet {sheet}: {len(site_rows)} sites, {len(duplicate_sites)} duplicated, {blank} blank or non-numeric results")
+            for site, count in duplicate_sites.items():
+                print(f"  Duplicate site: {site} has {count} rows")
+    return problems
+
+
+def main(argv = None):
+    args = parse_args(argv)
+
+    # Reports are only ever written to files, so never let matplotlib pick an
+    # interactive backend
+    os.environ['MPLBACKEND'] = 'Agg'
+
+    import qap_batch
+    import qap_ingest
+
+    if args.no_cache:
+        qap_ingest.use_cache = False
+    program = qap_batch.program_module(args.program)
+
+    if args.validate_only:
+        return 1 if validate(program, args.workbook, args.sheets, args.output_dir) else 0
+
+    options = {
+        'workers': args.workers,
+        'incremental': args.incremental,
+        'resume': args.resume,
+        'checkpoint': args.checkpoint,
+        'consensus': args.consensus,
+        'exclusion': args.exclusion,
+        'z_scores': args.z_scores,
+    }
+    if args.output_dir:
+        options['output_dir'] = args.output_dir
+    if args.template:
+        options['template_path'] = args.template
+
+    reports = qap_batch.run_workbook(program, args.workbook, args.issuer, sheets = args.sheets, **options)
+    if args.incremental:
+        for sheet, report in reports.items():
+            print(f"Sheet {sheet}: rendered {len(report['changes'])} of {len(report['changes']) + len(report['skipped'])} sites, skipped {len(report['skipped'])} unchanged")
+            for site, reasons in report['changes']:
+                print(f"  {site}: {', '.join(reasons)}")
+
+    # Sheets of other programs are expected to fail when running a whole
+    # workbook, but a sheet asked for by name must succeed
+    missing = [sheet for sheet in args.sheets or [] if sheet not in reports]
+    failed = any(report['errors'] for report in reports.values())
+    return 1 if missing or failed or not reports else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
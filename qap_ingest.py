@@ -0,0 +1,209 @@
+import contextlib
+import hashlib
+import os
+import threading
+import uuid
+import warnings
+import pandas as pd
+
+# python-calamine reads .xlsx several times faster than openpyxl; use it when
+# it is installed and fall back to openpyxl otherwise
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+# Parquet needs pyarrow; without it the cache stores pickles instead
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Parsed sheets are cached in a Cache folder in the run's output directory
+# (see cache_dir_for()), keyed by workbook, its modification time and size, the
+# sheet and the columns read. Setting use_cache to False (or passing
+# cache = False) always re-reads the workbook.
+use_cache = True
+CACHE_DIR_NAME = 'Cache'
+cache_limit = 256 * 1024 * 1024
+
+# Workbooks held open by open_workbook(), shared by every thread reading the
+# same file. Each entry counts its users so the last one out closes it, and
+# has a lock so only one thread parses from the open file at a time.
+_workbooks = {}
+_lock = threading.Lock()
+
+
+def default_engine():
+    return 'calamine' if python_calamine is not None else 'openpyxl'
+
+
+@contextlib.contextmanager
+def open_workbook(file_path, engine = None):
+    """Keep a workbook open for the duration of the block.
+
+    Every read_results() of the same file inside the block reuses the one
+    open workbook instead of opening and indexing the .xlsx again. Nested
+    blocks and other threads opening the same file share it, and it is closed
+    when the last of them exits.
+    """
+    key = os.path.abspath(file_path)
+    with _lock:
+        entry = _workbooks.get(key)
+        if entry is None:
+            entry = {'workbook': pd.ExcelFile(file_path, engine = engine or default_engine()), 'users': 0, 'lock': threading.Lock()}
+            _workbooks[key] = entry
+        entry['users'] += 1
+    try:
+        yield entry['workbook']
+    finally:
+        _release(key, entry)
+
+
+def _release(key, entry):
+    with _lock:
+        entry['users'] -= 1
+        if entry['users'] == 0:
+            del _workbooks[key]
+            entry['workbook'].close()
+
+
+def _read_excel(file_path, engine, **kwargs):
+    # Parse from the open workbook if there is one, holding it open until done
+    key = os.path.abspath(file_path)
+    with _lock:
+        entry = _workbooks.get(key)
+        if entry is not None:
+            entry['users'] += 1
+    if entry is None:
+        return pd.read_excel(file_path, engine = engine or default_engine(), **kwargs)
+    try:
+        with entry['lock']:
+            return pd.read_excel(entry['workbook'], **kwargs)
+    finally:
+        _release(key, entry)
+
+
+def cache_dir_for(output_dir):
+    """The sheet cache of runs writing their reports to output_dir."""
+    return os.path.join(output_dir, CACHE_DIR_NAME)
+
+
+def _cache_path(directory, file_path, sheet_name, columns):
+    stat = os.stat(file_path)
+    key = '\0'.join([os.path.abspath(file_path), str(stat.st_mtime_ns), str(stat.st_size), str(sheet_name)] + list(columns))
+    extension = '.parquet' if pyarrow is not None else '.pkl'
+    return os.path.join(directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + extension)
+
+
+def _load_cached(path):
+    try:
+        if path.endswith('.parquet'):
+            Database = pd.read_parquet(path)
+        else:
+            Database = pd.read_pickle(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A truncated or foreign file: drop it and parse the workbook again
+        warnings.warn(f"Ignoring unreadable cache file {path}: {e}")
+        os.remove(path)
+        return None
+    # Touch it so that eviction sees it as recently used
+    os.utime(path)
+    return Database
+
+
+def _store_cached(path, Database):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok = True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        if path.endswith('.parquet'):
+            Database.to_parquet(temp_path, index = False)
+        else:
+            Database.to_pickle(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    evict_cache(directory, keep = path)
+
+
+def evict_cache(directory, keep = None):
+    """Delete the least recently used files of the cache in `directory`
+    until it fits in cache_limit bytes. `keep` is never deleted."""
+    if not os.path.isdir(directory):
+        return
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(('.parquet', '.pkl')):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= cache_limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear_cache(directory):
+    if not os.path.isdir(directory):
+        return
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(('.parquet', '.pkl')):
+            os.remove(entry.path)
+
+
+def read_results(file_path, sheet_name, analytes, engine = None, cache = None, cache_dir = None, store = True):
+    """Read the site column and the analyte columns of one cycle sheet.
+
+    Only those columns are parsed. Header names are stripped of surrounding
+    whitespace, and analyte cells that are not numbers become NaN. Raises
+    ValueError if the sheet lacks any of the columns.
+
+    Given a `cache_dir`, the cleaned frame is cached there (see use_cache), so
+    reading the same sheet of an unchanged workbook again skips the .xlsx
+    parse. store = False only reads the cache and never adds to it.
+    """
+    wanted = ['site'] + list(analytes)
+    if cache is None:
+        cache = use_cache
+    cache = cache and cache_dir is not None
+
+    if cache:
+        path = _cache_path(cache_dir, file_path, sheet_name, wanted)
+        Database = _load_cached(path)
+        if Database is not None:
+            return Database
+
+    wanted_names = set(wanted)
+    Database = _read_excel(
+        file_path,
+        engine,
+        sheet_name = sheet_name,
+        usecols = lambda name: str(name).strip() in wanted_names,
+    )
+    Database.columns = Database.columns.str.strip()
+
+    missing = [column for column in wanted if column not in Database.columns]
+    if missing:
+        raise ValueError(f"Sheet {sheet_name} is missing columns: {', '.join(missing)}")
+
+    Database[list(analytes)] = Database[list(analytes)].apply(pd.to_numeric, errors = 'coerce')
+
+    if cache and store:
+        try:
+            _store_cached(path, Database)
+        except (OSError, ValueError, TypeError) as e:
+            # Caching is only an optimisation; e.g. a site column mixing
+            # numbers and names cannot be written to Parquet
+            warnings.warn(f"Not caching sheet {sheet_name}: {e}")
+    return Database
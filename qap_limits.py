@@ -0,0 +1,56 @@
+import numpy as np
+
+# An ALP rule reads "+/- absolute up to threshold, then +/- relative": a
+# consensus value above the threshold gets the relative band, anything else
+# the absolute one. Rules without a threshold are absolute throughout.
+#
+#   'pco2': {'threshold': 34, 'absolute': 2, 'relative': 0.06, 'decimals': 1}
+#
+# Limits are rounded to `decimals` places, the precision they are reported at.
+
+
+def _rule_arrays(rules, analytes):
+    threshold = np.array([rules[analyte].get('threshold', np.inf) for analyte in analytes], dtype = float)
+    absolute = np.array([rules[analyte]['absolute'] for analyte in analytes], dtype = float)
+    relative = np.array([rules[analyte].get('relative', 0.0) for analyte in analytes], dtype = float)
+    decimals = np.array([rules[analyte]['decimals'] for analyte in analytes], dtype = int)
+    return threshold, absolute, relative, decimals
+
+
+def _round_to(values, decimals):
+    # Round like f"{value:.2f}" does (half-even on the exact binary value).
+    # numpy's round scales first, which can move a value that is close to a
+    # half across it, so those few values are formatted one by one instead
+    decimals = np.broadcast_to(decimals, values.shape)
+    scale = 10.0 ** decimals
+    scaled = values * scale
+    rounded = np.round(scaled) / scale
+    with np.errstate(invalid = 'ignore'):
+        # inf % 1 is NaN, like NaN itself: neither is near a half
+        near_half = np.abs(np.abs(scaled) % 1 - 0.5) <= 1e-9 * np.maximum(1, np.abs(scaled))
+    for index in zip(*np.nonzero(near_half)):
+        rounded[index] = float(f"{values[index]:.{decimals[index]}f}")
+    return rounded
+
+
+def limit_arrays(rules, analytes, centres):
+    """Evaluate the rules for an array of consensus values.
+
+    `centres` has one column per analyte, in `analytes` order, and any number
+    of leading dimensions (a single cycle, or one row per cycle for a bulk
+    recalculation). Returns the lower and upper limit arrays.
+    """
+    centres = np.asarray(centres, dtype = float)
+    threshold, absolute, relative, decimals = _rule_arrays(rules, analytes)
+
+    proportional = centres > threshold
+    lower = np.where(proportional, centres * (1 - relative), centres - absolute)
+    upper = np.where(proportional, centres * (1 + relative), centres + absolute)
+    return _round_to(lower, decimals), _round_to(upper, decimals)
+
+
+def alp_limits(rules, centres):
+    """Return {analyte: (lower, upper)} for a dict of consensus values."""
+    analytes = list(centres)
+    lower, upper = limit_arrays(rules, analytes, [centres[analyte] for analyte in analytes])
+    return {analyte: (low, high) for analyte, low, high in zip(analytes, lower.tolist(), upper.tolist())}
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sys
+import uuid
+import numpy as np
+import qap_pool
+import qap_templates
+
+# Incremental runs keep a manifest per program and cycle sheet next to the
+# reports. For every site it records the output path and one hash per input
+# of that site's report:
+#
+#   site      the site's results, limits, consensus and verdicts
+#   cycle     the rest of the cycle context (sheet, issuer, names, units)
+#   chart     what the charts plot: every site's points, limits and labels
+#   template  the Word template's bytes
+#   code      the source of the program and of the rendering modules
+#
+# A site is rendered again only if a hash changed or its report is missing.
+# Sites are keyed by str(site), the form they take in JSON.
+# Every chart plots all sites' results, so a new submission that is plotted
+# changes every site's chart; setting skip_chart_only_changes keeps reports
+# whose only difference is that.
+skip_chart_only_changes = False
+
+CODE_MODULES = ('qap_charts', 'qap_tables', 'qap_templates')
+
+# Context entries that do not affect what a report shows
+_UNHASHED_CONTEXT = ('cycle_key', 'chart_panels', 'output_dir')
+
+
+def _digest(data):
+    return hashlib.sha1(data.encode('utf-8') if isinstance(data, str) else data).hexdigest()
+
+
+def _json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    return str(value)
+
+
+def _chart_hash(panels):
+    # x positions are random jitter, redrawn on every run
+    return _digest(json.dumps([{key: value for key, value in panel.items() if key != 'x'} for panel in panels], sort_keys = True, default = _json))
+
+
+def _code_hash(render_site):
+    digest = hashlib.sha1()
+    for name in (render_site.__module__,) + CODE_MODULES:
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cycle_hashes(render_site, context):
+    """The hashes shared by every site of the cycle."""
+    cycle = {key: value for key, value in context.items() if key not in _UNHASHED_CONTEXT}
+    return {
+        'cycle': _digest(json.dumps(cycle, sort_keys = True, default = _json)),
+        'chart': _chart_hash(context['chart_panels']),
+        'template': _digest(qap_templates.template_bytes(context['template_path'])),
+        'code': _code_hash(render_site),
+    }
+
+
+def site_hash(site_data):
+    return _digest(site_data.to_csv())
+
+
+def manifest_path(render_site, context):
+    program = render_site.__module__.split('_')[0]
+    return os.path.join(context['output_dir'], f"Manifest_{program}_{context['sheet_name']}.json")
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding = 'utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return {}
+
+
+def save_manifest(path, manifest):
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w', encoding = 'utf-8') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(temp_path, path)
+
+
+def _changes(entry, hashes):
+    if entry is None:
+        return ['new site']
+    changed = [name for name, value in hashes.items() if entry['hashes'].get(name) != value]
+    if changed == ['chart'] and skip_chart_only_changes:
+        changed = []
+    if not changed and not os.path.exists(entry['output']):
+        changed = ['report missing']
+    return changed
+
+
+def render_changed(render_site, sites, context, workers = 1, on_result = None):
+    """Render only the sites whose report inputs changed since the last run.
+
+    Returns the render_sites() report plus 'skipped', the (site, report
+    path) pairs left as they were, and 'changes', the (site, reasons) pairs
+    that were rendered or failed. Manifest entries of sites not in `sites`
+    are kept.
+    """
+    path = manifest_path(render_site, context)
+    previous = load_manifest(path)
+    shared = cycle_hashes(render_site, context)
+
+    to_render = []
+    hashes = {}
+    changes = []
+    skipped = []
+    names = {str(site) for site, _ in sites}
+    manifest = {key: entry for key, entry in previous.items() if key not in names}
+    for site, site_data in sites:
+        key = str(site)
+        hashes[key] = {'site': site_hash(site_data), **shared}
+        entry = previous.get(key)
+        reasons = _changes(entry, hashes[key])
+        if reasons:
+            to_render.append((site, site_data))
+            changes.append((site, reasons))
+        else:
+            skipped.append((site, entry['output']))
+            manifest[key] = entry
+
+    report = qap_pool.render_sites(render_site, to_render, context, workers = workers, on_result = on_result)
+    # Failed sites stay out of the manifest so the next run retries them
+    for site, output_path in report['outputs']:
+        manifest[str(site)] = {'hashes': hashes[str(site)], 'output': output_path}
+    save_manifest(path, manifest)
+
+    report['skipped'] = skipped
+    report['changes'] = changes
+    return report
@@ -0,0 +1,111 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Render on threads in this process instead of on worker processes. Threads
+# share the warm templates and start instantly, but only overlap where
+# rendering releases the GIL.
+use_threads = False
+
+_worker = {}
+
+
+def _init_worker(render_site = None, context = None):
+    # Workers never show a window, so keep matplotlib off the GUI backends
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker['render_site'] = render_site
+    _worker['context'] = context
+
+
+def _render_in_worker(site, site_data):
+    return render_one(_worker['render_site'], site, site_data, _worker['context'])
+
+
+def render_one(render_site, site, site_data, context):
+    try:
+        return render_site(site, site_data, context), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def worker_count(workers):
+    """0 or None means every core."""
+    if not workers or workers < 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def open_pool(workers = None):
+    """A pool for submit_site(), shared by any number of cycles and
+    programs. Use it as a context manager."""
+    if use_threads:
+        return ThreadPoolExecutor(max_workers = worker_count(workers))
+    return ProcessPoolExecutor(max_workers = worker_count(workers), initializer = _init_worker)
+
+
+def submit_site(executor, render_site, site, site_data, context):
+    # The context travels with each site, since one pool serves many cycles
+    return executor.submit(render_one, render_site, site, site_data, context)
+
+
+def future_result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        # The worker itself died (e.g. BrokenProcessPool)
+        return None, f"{type(e).__name__}: {e}"
+
+
+def collect_results(futures):
+    return [future_result(future) for future in futures]
+
+
+def _gather(sites, results, on_result):
+    # `results` is lazy, so on_result hears about each site as it finishes
+    gathered = []
+    for (site, _), result in zip(sites, results):
+        gathered.append(result)
+        if on_result is not None:
+            on_result(site, *result)
+    return gathered
+
+
+def site_report(sites, results):
+    """Pair render results with their sites as {'outputs', 'errors'}."""
+    outputs = []
+    errors = []
+    for (site, _), (output_path, error) in zip(sites, results):
+        if error is None:
+            outputs.append((site, output_path))
+        else:
+            errors.append((site, error))
+
+    for site, error in errors:
+        print(f"Failed site: {site}: {error}")
+
+    return {'outputs': outputs, 'errors': errors}
+
+
+def render_sites(render_site, sites, context, workers = 1, on_result = None):
+    """Render every (site, site_data) pair and collect a per-site report.
+
+    workers = 1 renders in this process; anything larger fans the sites out
+    to a process pool (or a thread pool, see use_threads), and 0 or None uses
+    every core. The cycle context is sent to each worker process once rather
+    than with every site. on_result(site, output_path, error) is called in
+    this process as each site completes, in site order.
+    """
+    workers = worker_count(workers)
+
+    if workers == 1 or len(sites) < 2:
+        results = _gather(sites, (render_one(render_site, site, site_data, context) for site, site_data in sites), on_result)
+    elif use_threads:
+        with ThreadPoolExecutor(max_workers = min(workers, len(sites))) as executor:
+            futures = [executor.submit(render_one, render_site, site, site_data, context) for site, site_data in sites]
+            results = _gather(sites, (future_result(future) for future in futures), on_result)
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers, len(sites)), initializer = _init_worker, initargs = (render_site, context)) as executor:
+            futures = [executor.submit(_render_in_worker, site, site_data) for site, site_data in sites]
+            results = _gather(sites, (future_result(future) for future in futures), on_result)
+
+    return site_report(sites, results)
@@ -0,0 +1,273 @@
+"""Resident report worker fed through a spool directory.
+
+Start the worker once and leave it running; it keeps the program modules,
+the parsed Word templates and matplotlib's fonts loaded between jobs:
+
+    python qap_service.py serve
+
+Jobs are JSON files dropped into <spool>/incoming. submit() writes one and
+wait() picks up its result from <spool>/done, so any process on the machine
+can act as a client, e.g.
+
+    python qap_service.py submit epoc Results.xlsx C1 "jane doe" --wait
+
+Several workers can share a spool. A worker claims a job by renaming it
+into <spool>/working with its host and process id in the name, and a
+starting worker only puts back the claims of workers that are gone.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+
+spool_dir = r"C:\iCCnet QAP Program\Spool"
+poll_interval = 0.5
+# A claim made on another machine cannot be checked, so it is only taken
+# back once it is this old
+stale_claim_seconds = 6 * 60 * 60
+
+# A job file holds these keys, and may add any of JOB_OPTIONS, which are
+# passed on to the program's run()
+JOB_KEYS = ('program', 'workbook', 'sheet', 'issuer')
+JOB_OPTIONS = ('output_dir', 'template_path', 'consensus', 'exclusion', 'z_scores')
+
+
+def _spool(name, spool = None):
+    path = os.path.join(spool or spool_dir, name)
+    os.makedirs(path, exist_ok = True)
+    return path
+
+
+def _write_json(path, data):
+    # Write under a temporary name and rename, so a reader never sees half
+    # a file
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w', encoding = 'utf-8') as f:
+        json.dump(data, f, indent = 1)
+    os.replace(temp_path, path)
+
+
+def submit(program, workbook, sheet, issuer, spool = None, **options):
+    """Queue a job for the worker and return its id."""
+    job_id = uuid.uuid4().hex
+    job = {'id': job_id, 'program': program, 'workbook': os.path.abspath(workbook), 'sheet': sheet, 'issuer': issuer, 'submitted': time.time()}
+    job.update(options)
+    _write_json(os.path.join(_spool('incoming', spool), f"{job_id}.json"), job)
+    return job_id
+
+
+def wait(job_id, spool = None, timeout = None):
+    """Return the result of a submitted job once the worker has written it.
+
+    Raises TimeoutError if `timeout` seconds pass first.
+    """
+    path = os.path.join(_spool('done', spool), f"{job_id}.json")
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not os.path.exists(path):
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"No result for job {job_id} after {timeout} s")
+        time.sleep(poll_interval)
+    with open(path, encoding = 'utf-8') as f:
+        return json.load(f)
+
+
+def warm_up():
+    """Load everything a job needs before the first one arrives."""
+    os.environ['MPLBACKEND'] = 'Agg'
+    import qap_batch
+    import qap_templates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    for name in qap_batch.PROGRAMS:
+        program = qap_batch.program_module(name)
+        try:
+            qap_templates.template_bytes(program.TEMPLATE_PATH)
+        except OSError as e:
+            print(f"Template not preloaded for {name}: {e}")
+
+    # Drawing some text builds matplotlib's font cache and opens the fonts
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    fig.text(0.5, 0.5, "QAP", fontweight = 'bold')
+    fig.canvas.draw()
+
+
+def run_job(job):
+    """Run one job dict and return its JSON-ready result."""
+    import qap_batch
+
+    started = time.time()
+    result = {'id': job.get('id'), 'outputs': [], 'errors': [], 'duplicate_sites': {}, 'error': None}
+    try:
+        missing = [key for key in JOB_KEYS if not job.get(key)]
+        if missing:
+            raise ValueError(f"Job is missing {', '.join(missing)}")
+        program = qap_batch.program_module(job['program'])
+        options = {key: job[key] for key in JOB_OPTIONS if job.get(key) is not None}
+        report = program.run(job['workbook'], job['sheet'], job['issuer'], workers = 1, **options)
+        result['outputs'] = [list(output) for output in report['outputs']]
+        result['errors'] = [list(error) for error in report['errors']]
+        result['duplicate_sites'] = {str(site): count for site, count in report['duplicate_sites'].items()}
+    except Exception as e:
+        print(f"Failed job: {job.get('id')}: {type(e).__name__}: {e}")
+        result['error'] = f"{type(e).__name__}: {e}"
+    finished = time.time()
+    result['queued_seconds'] = round(started - job['submitted'], 3) if job.get('submitted') else None
+    result['seconds'] = round(finished - started, 3)
+    return result
+
+
+def _process_alive(pid):
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error = True)
+        handle = kernel32.OpenProcess(0x100000, False, pid)  # SYNCHRONIZE
+        if not handle:
+            # Access denied means the process exists
+            return ctypes.get_last_error() == 5
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == 0x102  # WAIT_TIMEOUT
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _job_id(path):
+    # working/ names are <job id>@<host>@<pid>.json
+    return os.path.basename(path)[:-len('.json')].split('@')[0]
+
+
+def _claim_next(incoming, working):
+    # Oldest first; renaming into working/ is the claim, so a job already
+    # taken by another worker, even one taken since it was listed, is
+    # simply skipped
+    jobs = []
+    for entry in os.scandir(incoming):
+        if entry.name.endswith('.json'):
+            try:
+                jobs.append((entry.stat().st_mtime, entry.name))
+            except OSError:
+                continue
+    for _, name in sorted(jobs):
+        path = os.path.join(working, f"{_job_id(name)}@{socket.gethostname()}@{os.getpid()}.json")
+        try:
+            os.replace(os.path.join(incoming, name), path)
+        except OSError:
+            continue
+        # The claim's age counts from here (see stale_claim_seconds)
+        os.utime(path)
+        return path
+    return None
+
+
+def _requeue_abandoned(incoming, working):
+    """Put the jobs claimed by workers that have stopped back in line."""
+    for name in os.listdir(working):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(working, name)
+        _, host, pid = (name[:-len('.json')].split('@') + ['', ''])[:3]
+        if host == socket.gethostname() and pid.isdigit():
+            # A claim under this process's own id is left from an earlier
+            # process that had the same id
+            abandoned = int(pid) == os.getpid() or not _process_alive(int(pid))
+        else:
+            try:
+                abandoned = time.time() - os.path.getmtime(path) > stale_claim_seconds
+            except OSError:
+                continue
+        if abandoned:
+            try:
+                os.replace(path, os.path.join(incoming, f"{_job_id(name)}.json"))
+            except OSError:
+                pass
+
+
+def serve(spool = None, once = False):
+    """Process jobs from the spool directory until interrupted.
+
+    once = True returns as soon as the queue is empty.
+    """
+    incoming = _spool('incoming', spool)
+    working = _spool('working', spool)
+    done = _spool('done', spool)
+
+    # Jobs left in working/ by a worker that stopped mid-job go back in line
+    _requeue_abandoned(incoming, working)
+
+    warm_up()
+    print(f"Waiting for jobs in {incoming}")
+    while True:
+        path = _claim_next(incoming, working)
+        if path is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        job_id = _job_id(path)
+        try:
+            with open(path, encoding = 'utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError) as e:
+            result = {'id': job_id, 'outputs': [], 'errors': [], 'error': f"Unreadable job file: {e}", 'queued_seconds': None, 'seconds': 0.0}
+        else:
+            job['id'] = job_id
+            result = run_job(job)
+        _write_json(os.path.join(done, f"{job_id}.json"), result)
+        os.remove(path)
+        print(f"Job {job_id}: {len(result['outputs'])} reports, {len(result['errors'])} failed in {result['seconds']} s")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Resident QAP report worker.")
+    parser.add_argument('--spool', help = "spool directory (default: %(default)s)", default = spool_dir)
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    serve_parser = commands.add_parser('serve', help = "run the worker")
+    serve_parser.add_argument('--once', action = 'store_true', help = "exit when the queue is empty")
+    submit_parser = commands.add_parser('submit', help = "queue a job")
+    for key in JOB_KEYS:
+        submit_parser.add_argument(key)
+    submit_parser.add_argument('--output-dir')
+    submit_parser.add_argument('--template')
+    submit_parser.add_argument('--consensus', choices = ('program', 'algorithm_a'))
+    submit_parser.add_argument('--exclusion', choices = ('cascade', 'independent'))
+    submit_parser.add_argument('--z-scores', action = 'store_true', default = None)
+    submit_parser.add_argument('--wait', action = 'store_true', help = "wait for the result and print it")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            serve(args.spool, once = args.once)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    options = {}
+    if args.output_dir:
+        options['output_dir'] = os.path.abspath(args.output_dir)
+    if args.template:
+        options['template_path'] = os.path.abspath(args.template)
+    for key in ('consensus', 'exclusion', 'z_scores'):
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    job_id = submit(args.program, args.workbook, args.sheet, args.issuer, spool = args.spool, **options)
+    if not args.wait:
+        print(job_id)
+        return 0
+    result = wait(job_id, spool = args.spool)
+    print(json.dumps(result, indent = 1))
+    return 1 if result['error'] or result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
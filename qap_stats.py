@@ -0,0 +1,224 @@
+import warnings
+import pandas as pd
+import numpy as np
+
+# Results outside [Q1 - 1.5 IQR, Q3 + 1.5 IQR] count as outliers, with the
+# quartiles taken at the 15th and 85th percentiles
+LOWER_QUANTILE = 0.15
+UPPER_QUANTILE = 0.85
+IQR_FACTOR = 1.5
+
+# How remove_outliers() excludes results from the consensus:
+#
+#   'cascade'      analyte by analyte in order, each analyte's fences taken
+#                  over the sites still left, and a site outside any fence
+#                  is dropped from every analyte
+#   'independent'  every analyte's fences taken over all sites, and a result
+#                  is dropped only from its own analyte
+exclusion_mode = 'cascade'
+
+# The consensus results are judged against: 'program' keeps each program's
+# own (the median or the trimmed mean of the results left after exclusion),
+# 'algorithm_a' uses the ISO 13528 Algorithm A robust mean of all results.
+# exclusion_mode and consensus_method are only the defaults of the programs'
+# prepare() and run() arguments of the same purpose.
+CONSENSUS_METHODS = ('program', 'algorithm_a')
+consensus_method = 'program'
+ALGORITHM_A_LABEL = 'Robust Mean'
+ALGORITHM_A_TOLERANCE = 1e-6
+ALGORITHM_A_MAX_ITERATIONS = 100
+
+
+def _quartiles(values):
+    # nanquantile warns about an analyte with no results and returns NaN,
+    # and loses the shape when there are no rows at all
+    if not len(values):
+        return np.full((2,) + values.shape[1:], np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanquantile(values, [LOWER_QUANTILE, UPPER_QUANTILE], axis = 0)
+
+
+def _fences(q1, q3):
+    iqr = q3 - q1
+    return q1 - IQR_FACTOR * iqr, q3 + IQR_FACTOR * iqr
+
+
+def outlier_bounds(data, analytes):
+    """Compute the outlier fences of every analyte in one pass.
+
+    Returns {analyte: {'q1', 'q3', 'iqr', 'lower', 'upper'}}; an analyte with
+    no results gets NaN bounds, so nothing is flagged against it.
+    """
+    quartiles = _quartiles(data[list(analytes)].to_numpy(dtype = float))
+    bounds = {}
+    for analyte, q1, q3 in zip(analytes, *quartiles):
+        q1 = float(q1)
+        q3 = float(q3)
+        iqr = q3 - q1
+        bounds[analyte] = {
+            'q1': q1,
+            'q3': q3,
+            'iqr': iqr,
+            'lower': q1 - IQR_FACTOR * iqr,
+            'upper': q3 + IQR_FACTOR * iqr,
+        }
+    return bounds
+
+
+def inlier_mask(data, analytes, mode = None):
+    """Which results of `analytes` count towards the consensus.
+
+    Returns a boolean array with one row per row of `data` and one column per
+    analyte, following `mode` (exclusion_mode if None). Missing results are
+    never counted; in 'cascade' mode they drop their whole row, as an
+    outlier does.
+    """
+    mode = exclusion_mode if mode is None else mode
+    values = data[list(analytes)].to_numpy(dtype = float)
+
+    if mode == 'independent':
+        lower, upper = _fences(*_quartiles(values))
+        return (lower <= values) & (values <= upper)
+    if mode != 'cascade':
+        raise ValueError(f"Unknown exclusion mode: {mode}")
+
+    # Each analyte's fences depend on the sites the previous ones left, so
+    # the analytes go in order, narrowing one row mask rather than the frame
+    keep = np.ones(len(values), dtype = bool)
+    for column in values.T:
+        if not keep.any():
+            break
+        lower, upper = _fences(*_quartiles(column[keep]))
+        keep &= (lower <= column) & (column <= upper)
+    return np.repeat(keep[:, None], values.shape[1], axis = 1)
+
+
+def remove_outliers(data, analytes, mode = None):
+    """The rows of `data` left for the consensus once outliers are excluded.
+
+    In 'cascade' mode these are the rows inside every fence. In
+    'independent' mode every row is kept and an excluded result is blanked
+    to NaN in its own analyte only.
+    """
+    mask = inlier_mask(data, analytes, mode)
+    if (exclusion_mode if mode is None else mode) == 'cascade':
+        return data[mask.all(axis = 1)]
+    cleaned = data.copy()
+    cleaned[list(analytes)] = cleaned[list(analytes)].where(mask)
+    return cleaned
+
+
+def algorithm_a(data, analytes):
+    """ISO 13528 Algorithm A robust mean and SD of every analyte at once.
+
+    Starts from the median and the scaled median absolute deviation, then
+    winsorizes the results at 1.5 SD around the mean and re-estimates both
+    until neither moves by more than ALGORITHM_A_TOLERANCE (relative).
+    Returns {analyte: {'mean', 'sd', 'n'}}. An analyte with fewer than two
+    results, or whose results have no spread, is not iterated: its mean is
+    the median and its SD is NaN. One with no results gets a NaN mean too.
+    """
+    values = data[list(analytes)].to_numpy(dtype = float)
+    counts = np.count_nonzero(~np.isnan(values), axis = 0)
+    mean = np.full(values.shape[1], np.nan)
+    sd = np.full(values.shape[1], np.nan)
+
+    if len(values):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmedian(values, axis = 0)
+            sd = 1.483 * np.nanmedian(np.abs(values - mean), axis = 0)
+            sd[counts < 2] = np.nan
+            # Only analytes with a spread to winsorize are iterated
+            active = sd > 0
+            for _ in range(ALGORITHM_A_MAX_ITERATIONS):
+                if not active.any():
+                    break
+                delta = 1.5 * sd[active]
+                winsorized = np.clip(values[:, active], mean[active] - delta, mean[active] + delta)
+                new_mean = np.nanmean(winsorized, axis = 0)
+                new_sd = 1.134 * np.nanstd(winsorized, axis = 0, ddof = 1)
+                converged = (np.isclose(new_mean, mean[active], rtol = ALGORITHM_A_TOLERANCE, atol = 0)
+                             & np.isclose(new_sd, sd[active], rtol = ALGORITHM_A_TOLERANCE, atol = 0))
+                mean[active] = new_mean
+                sd[active] = new_sd
+                active[active] = ~converged & (new_sd > 0)
+        sd[~(sd > 0)] = np.nan
+
+    return {
+        analyte: {'mean': float(mean[i]), 'sd': float(sd[i]), 'n': int(counts[i])}
+        for i, analyte in enumerate(analytes)
+    }
+
+
+def is_outlier(value, analyte, bounds):
+    bound = bounds[analyte]
+    return value < bound['lower'] or value > bound['upper']
+
+
+def site_rows(data, keep = 'first'):
+    """Index the results by site, one row per site, in order of appearance.
+
+    Rows without a site are dropped. A site entered more than once is
+    represented by its `keep` ('first' or 'last') row. Returns the indexed
+    rows and {site: number of rows} for the duplicated sites, for the caller
+    to report.
+    """
+    data = data.dropna(subset = ['site'])
+    counts = data.groupby('site', sort = False).size()
+    duplicates = {site: int(count) for site, count in counts[counts > 1].items()}
+    return data.drop_duplicates('site', keep = keep).set_index('site'), duplicates
+
+
+def interpretation_matrix(results, consensus, lower_limits, upper_limits, bounds = None, robust_statistics = None):
+    """Judge every site's result for every analyte in one vectorized pass.
+
+    `results` has one row per site and one column per analyte; `consensus`,
+    `lower_limits` and `upper_limits` map each analyte to its value. Returns a
+    frame indexed by (site, analyte) with the result, lower limit, consensus,
+    upper limit, verdict and outlier flag. A result outside the limits is an
+    outlier when it is also outside the `bounds` fences; a missing result is
+    Unacceptable but never an outlier.
+
+    Given the algorithm_a() statistics, the frame also has a z_score column:
+    (result - robust mean) / robust SD, as in ISO 13528. Both come from
+    Algorithm A whatever consensus the results are judged against, so the
+    z-score never mixes estimators. It is NaN for a missing result or an
+    undefined SD.
+    """
+    analytes = list(results.columns)
+    values = results.to_numpy(dtype = float)
+    lower = np.array([lower_limits[analyte] for analyte in analytes], dtype = float)
+    centre = np.array([consensus[analyte] for analyte in analytes], dtype = float)
+    upper = np.array([upper_limits[analyte] for analyte in analytes], dtype = float)
+
+    acceptable = (lower <= values) & (values <= upper)
+    if bounds is None:
+        outlier = np.zeros(values.shape, dtype = bool)
+    else:
+        lower_fence = np.array([bounds[analyte]['lower'] for analyte in analytes])
+        upper_fence = np.array([bounds[analyte]['upper'] for analyte in analytes])
+        outlier = ~acceptable & ((values < lower_fence) | (values > upper_fence))
+
+    shape = values.shape
+    index = pd.MultiIndex.from_product([results.index, analytes], names = ['site', 'analyte'])
+    columns = {
+        'result': values.ravel(),
+        'lower_limit': np.broadcast_to(lower, shape).ravel(),
+        'consensus': np.broadcast_to(centre, shape).ravel(),
+        'upper_limit': np.broadcast_to(upper, shape).ravel(),
+        'verdict': np.where(acceptable, 'Acceptable', 'Unacceptable').ravel(),
+        'outlier': outlier.ravel(),
+    }
+    if robust_statistics is not None:
+        robust_mean = np.array([robust_statistics[analyte]['mean'] for analyte in analytes], dtype = float)
+        robust_sd = np.array([robust_statistics[analyte]['sd'] for analyte in analytes], dtype = float)
+        robust_sd[~(robust_sd > 0)] = np.nan
+        columns['z_score'] = ((values - robust_mean) / robust_sd).ravel()
+    return pd.DataFrame(columns, index = index)
+
+
+def site_interpretations(matrix):
+    """Split the matrix into (site, per-analyte frame) pairs, in site order."""
+    return [(site, interpretation.droplevel('site')) for site, interpretation in matrix.groupby(level = 'site', sort = False)]
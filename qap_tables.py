@@ -0,0 +1,123 @@
+from xml.sax.saxutils import escape
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+
+# The results table is written as one XML fragment and inserted in a single
+# step, rather than cell by cell through python-docx, which costs several
+# object lookups and element insertions for every run.
+#
+# Its look comes from a named table style: white bold header on dark red,
+# bold first column, banded rows, centred 10 pt text. Cells carry only their
+# text and, for verdicts, a colour. A template may define the style itself
+# (e.g. edited in Word); templates without it get the default below when
+# they are loaded.
+#
+# A cell is its text, or a list of runs; a run is its text, or a
+# (text, properties) pair where the properties are run_xml() keywords.
+
+# Whether the results table gets a z-score column before the
+# Interpretation: each result against the Algorithm A robust mean and SD
+# (see qap_stats.interpretation_matrix). This is the default of the
+# programs' z_scores argument, which they copy into the cycle context.
+show_z_scores = False
+Z_SCORE_HEADER = 'Robust Z-Score'
+
+RESULTS_STYLE = 'QAP Results'
+RESULTS_STYLE_ID = 'QAPResults'
+
+VERDICT_COLOURS = {'Acceptable': '008000', 'Unacceptable': 'FF0000'}
+OUTLIER_MARK = ('‡', {'superscript': True})
+
+_RESULTS_STYLE_XML = (
+    f'<w:style {nsdecls("w")} w:type="table" w:customStyle="1" w:styleId="{RESULTS_STYLE_ID}">'
+    f'<w:name w:val="{RESULTS_STYLE}"/>'
+    '<w:pPr><w:jc w:val="center"/></w:pPr>'
+    '<w:rPr><w:color w:val="000000"/><w:sz w:val="20"/></w:rPr>'
+    '<w:tblPr><w:tblStyleRowBandSize w:val="1"/></w:tblPr>'
+    '<w:tblStylePr w:type="firstRow">'
+    '<w:rPr><w:b/><w:color w:val="FFFFFF"/><w:sz w:val="24"/></w:rPr>'
+    '<w:tcPr><w:shd w:val="clear" w:color="auto" w:fill="800000"/></w:tcPr>'
+    '</w:tblStylePr>'
+    '<w:tblStylePr w:type="firstCol"><w:rPr><w:b/></w:rPr></w:tblStylePr>'
+    '<w:tblStylePr w:type="band1Horz"><w:tcPr><w:shd w:val="clear" w:color="auto" w:fill="FCF7EC"/></w:tcPr></w:tblStylePr>'
+    '<w:tblStylePr w:type="band2Horz"><w:tcPr><w:shd w:val="clear" w:color="auto" w:fill="FFFFFF"/></w:tcPr></w:tblStylePr>'
+    '</w:style>'
+)
+
+
+def ensure_results_style(doc):
+    """Add the results table style to doc unless it already has one."""
+    styles = doc.styles.element
+    if not styles.xpath(f'w:style[@w:styleId="{RESULTS_STYLE_ID}"]'):
+        styles.append(parse_xml(_RESULTS_STYLE_XML))
+
+
+def run_xml(text, bold = False, color = None, size = None, superscript = False):
+    properties = ''
+    if bold:
+        properties += '<w:b/>'
+    if color:
+        properties += f'<w:color w:val="{color}"/>'
+    if size:
+        properties += f'<w:sz w:val="{int(size * 2)}"/>'
+    if superscript:
+        properties += '<w:vertAlign w:val="superscript"/>'
+
+    xml = '<w:r>'
+    if properties:
+        xml += f'<w:rPr>{properties}</w:rPr>'
+    if text:
+        space = ' xml:space="preserve"' if text.strip() != text else ''
+        xml += f'<w:t{space}>{escape(text)}</w:t>'
+    return xml + '</w:r>'
+
+
+def _cell_xml(cell, width):
+    runs = [cell] if isinstance(cell, str) else cell
+    xml = ''
+    for run in runs:
+        text, properties = (run, {}) if isinstance(run, str) else run
+        if text:
+            xml += run_xml(text, **properties)
+    return f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr><w:p>{xml}</w:p></w:tc>'
+
+
+def verdict_cell(verdict, outlier = False):
+    """The Interpretation cell: the coloured verdict, marked if an outlier."""
+    cell = [(verdict, {'color': VERDICT_COLOURS[verdict]})]
+    if outlier:
+        cell.append(OUTLIER_MARK)
+    return cell
+
+
+def with_z_scores(header, rows, z_scores):
+    """Insert a z-score column before the last (Interpretation) column.
+
+    `z_scores` holds one value per row, NaN where there is none.
+    """
+    texts = ['' if z != z else f"{z:.2f}" for z in z_scores]
+    header = header[:-1] + [Z_SCORE_HEADER, header[-1]]
+    rows = [row[:-1] + [text, row[-1]] for row, text in zip(rows, texts)]
+    return header, rows
+
+
+def add_results_table(doc, header, rows, alignment = None):
+    """Append a results table in the results style to doc and return it.
+
+    `header` holds the column titles and `rows` one list of cells per
+    result row.
+    """
+    ensure_results_style(doc)
+    table = doc.add_table(rows = 0, cols = len(header))
+    table.style = RESULTS_STYLE
+    if alignment is not None:
+        table.alignment = alignment
+    widths = [column.get(qn('w:w')) for column in table._tbl.tblGrid.gridCol_lst]
+
+    xml = ''
+    for row in [header] + list(rows):
+        xml += '<w:tr>' + ''.join(_cell_xml(cell, width) for cell, width in zip(row, widths)) + '</w:tr>'
+
+    fragment = parse_xml(f'<w:tbl {nsdecls("w")}>{xml}</w:tbl>')
+    table._tbl.extend(list(fragment))
+    return table
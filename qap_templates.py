@@ -0,0 +1,183 @@
+import copy
+import io
+import os
+import re
+import threading
+from docx import Document
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.oxml.ns import qn
+from docx.text.run import Run
+import qap_tables
+
+W_P = qn('w:p')
+W_T = qn('w:t')
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+STORY_CONTENT_TYPES = (CT.WML_DOCUMENT_MAIN, CT.WML_HEADER, CT.WML_FOOTER)
+
+_templates = {}
+_lock = threading.Lock()
+
+
+def _cached_template(template_path):
+    mtime = os.stat(template_path).st_mtime_ns
+    with _lock:
+        entry = _templates.get(template_path)
+        if entry is None or entry['mtime'] != mtime:
+            with open(template_path, 'rb') as f:
+                blob = f.read()
+            document = Document(io.BytesIO(blob))
+            # Every report from this template gets the results table style
+            qap_tables.ensure_results_style(document)
+            entry = {
+                'mtime': mtime,
+                'blob': blob,
+                'document': document,
+                'indexes': {},
+            }
+            _templates[template_path] = entry
+    return entry
+
+
+def load_template(template_path):
+    """Return a fresh copy of the .docx template.
+
+    The file is read and parsed once per process and re-read only when its
+    mtime changes; every caller gets an independent deep copy of the parsed
+    parts, so edits to one report never leak into the next.
+    """
+    return copy.deepcopy(_cached_template(template_path)['document'])
+
+
+def template_bytes(template_path):
+    return _cached_template(template_path)['blob']
+
+
+def clear_templates():
+    with _lock:
+        _templates.clear()
+
+
+def _story_parts(doc):
+    # Body, headers and footers, keyed by part name so that a copy of the
+    # document can be matched back to the parts of its template
+    return {str(part.partname): part for part in doc.part.package.iter_parts() if part.content_type in STORY_CONTENT_TYPES}
+
+
+def _placeholder_pattern(placeholders):
+    # Longest first, so that e.g. 'SITE_NAME' wins over 'SITE'
+    return re.compile('|'.join(re.escape(p) for p in sorted(placeholders, key = len, reverse = True)))
+
+
+def _paragraph_texts(paragraph):
+    # Text boxes nest whole paragraphs inside a run; leave those to their own paragraph
+    return [t for t in paragraph.iter(W_T) if next(t.iterancestors(W_P)) is paragraph]
+
+
+def _element_path(element, root):
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+
+def _substitute_paragraph(paragraph, pattern, replacements, fonts):
+    texts = _paragraph_texts(paragraph)
+    full_text = ''.join(t.text or '' for t in texts)
+    matches = list(pattern.finditer(full_text))
+    if not matches:
+        return
+
+    starts = []
+    offset = 0
+    for t in texts:
+        starts.append(offset)
+        offset += len(t.text or '')
+
+    def locate(position):
+        for i in range(len(texts) - 1, -1, -1):
+            if starts[i] <= position:
+                return i
+        return 0
+
+    # Work backwards so that earlier offsets stay valid. The replacement goes
+    # into the run holding the first character of the placeholder, which keeps
+    # that run's formatting; any other runs the placeholder spans are trimmed.
+    for match in reversed(matches):
+        start, end = match.span()
+        first = locate(start)
+        last = locate(end - 1)
+        value = replacements[match.group()]
+
+        t = texts[first]
+        text = t.text or ''
+        tail = text[end - starts[first]:] if first == last else ''
+        t.text = text[:start - starts[first]] + value + tail
+        t.set(XML_SPACE, 'preserve')
+
+        if first != last:
+            for middle in texts[first + 1:last]:
+                middle.text = ''
+            texts[last].text = (texts[last].text or '')[end - starts[last]:]
+            texts[last].set(XML_SPACE, 'preserve')
+
+        if fonts and match.group() in fonts:
+            font = Run(t.getparent(), None).font
+            for name, setting in fonts[match.group()].items():
+                setattr(font, name, setting)
+
+
+def replace_placeholders(doc, replacements, fonts = None):
+    """Substitute every placeholder in `replacements` in one pass over the
+    body, tables, headers and footers of `doc`, keeping run formatting.
+
+    `fonts` optionally maps a placeholder to font attributes (size, bold, ...)
+    applied to the run that receives its replacement.
+    """
+    replacements = {placeholder: str(value) for placeholder, value in replacements.items()}
+    pattern = _placeholder_pattern(replacements)
+    for part in _story_parts(doc).values():
+        for paragraph in part.element.iter(W_P):
+            _substitute_paragraph(paragraph, pattern, replacements, fonts)
+    return doc
+
+
+def _placeholder_index(entry, placeholders):
+    key = frozenset(placeholders)
+    with _lock:
+        index = entry['indexes'].get(key)
+        if index is None:
+            pattern = _placeholder_pattern(placeholders)
+            index = {}
+            for partname, part in _story_parts(entry['document']).items():
+                root = part.element
+                paths = [_element_path(p, root) for p in root.iter(W_P)
+                         if pattern.search(''.join(t.text or '' for t in _paragraph_texts(p)))]
+                if paths:
+                    index[partname] = paths
+            entry['indexes'][key] = index
+    return index
+
+
+def fill_template(template_path, replacements, fonts = None):
+    """Return a copy of the template with its placeholders substituted.
+
+    Paragraphs holding any of the placeholders are located once per template
+    and placeholder set, so each copy only visits those paragraphs.
+    """
+    entry = _cached_template(template_path)
+    index = _placeholder_index(entry, replacements)
+    doc = copy.deepcopy(entry['document'])
+
+    replacements = {placeholder: str(value) for placeholder, value in replacements.items()}
+    pattern = _placeholder_pattern(replacements)
+    parts = _story_parts(doc)
+    for partname, paths in index.items():
+        root = parts[partname].element
+        for path in paths:
+            paragraph = root
+            for i in path:
+                paragraph = paragraph[i]
+            _substitute_paragraph(paragraph, pattern, replacements, fonts)
+    return doc
@@ -0,0 +1,45 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# Typical results of each analyte, as (centre, spread)
+RESULTS = {
+    'C1': {'ph': (7.40, 0.01), 'pco2': (40.5, 1.2), 'po2': (90, 3), 'na': (138, 1.5), 'k': (4.3, 0.1), 'ica': (1.12, 0.02),
+           'cl': (102, 1.5), 'hct': (40, 1.5), 'glu': (5.8, 0.2), 'lac': (2.2, 0.1), 'urea': (5.0, 0.2), 'creat': (90, 4)},
+    'L1': {'chol': (5.2, 0.15), 'ldl': (3.0, 0.15), 'hdl': (1.2, 0.05), 'trig': (1.5, 0.08)},
+    'W1': {'wcc': (7.0, 0.3), 'neut': (4.0, 0.2), 'lymph': (2.0, 0.15), 'mono': (0.5, 0.05), 'eosino': (0.2, 0.03), 'baso': (0.05, 0.01)},
+}
+
+
+def make_results(analytes, sites = 25, seed = 0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'site': [f"Site {i:02d}" for i in range(sites)]})
+    for analyte, (centre, spread) in analytes.items():
+        data[analyte] = np.round(rng.normal(centre, spread, sites), 2)
+    return data
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    """A workbook with one cycle sheet per program: C1 (epoc), I1 (istat),
+    L1 (lipids) and W1 (wbcdiff)."""
+    path = tmp_path / 'results.xlsx'
+    istat = {analyte: value for analyte, value in RESULTS['C1'].items() if analyte != 'cl'}
+    with pd.ExcelWriter(path) as writer:
+        make_results(RESULTS['C1']).to_excel(writer, sheet_name = 'C1', index = False)
+        make_results(istat, seed = 1).to_excel(writer, sheet_name = 'I1', index = False)
+        make_results(RESULTS['L1'], seed = 2).to_excel(writer, sheet_name = 'L1', index = False)
+        make_results(RESULTS['W1'], seed = 3).to_excel(writer, sheet_name = 'W1', index = False)
+    return str(path)
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    path = tmp_path / 'output'
+    path.mkdir()
+    return str(path)
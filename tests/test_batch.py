@@ -0,0 +1,22 @@
+import csv
+import glob
+import os
+import pytest
+import epoc_data_analysis
+import qap_batch
+
+
+def test_summary_is_written_to_the_output_dir(workbook, output_dir, tmp_path):
+    qap_batch.run_workbook(epoc_data_analysis, workbook, 'jane doe', sheets = ['C1'], output_dir = output_dir,
+                           template_path = str(tmp_path / 'missing.docx'))
+    summaries = glob.glob(os.path.join(output_dir, 'Batch_epoc_results_*.csv'))
+    assert len(summaries) == 1
+    with open(summaries[0], newline = '') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['sheet'] for row in rows] == ['C1']
+
+
+def test_duplicate_jobs_are_rejected(workbook):
+    jobs = [('epoc', workbook, 'C1', 'jane doe'), ('lipids', workbook, 'L1', 'jane doe'), ('epoc', workbook, 'C1', 'jane doe')]
+    with pytest.raises(ValueError, match = 'Duplicate jobs'):
+        qap_batch.run_jobs(jobs, workers = 1)
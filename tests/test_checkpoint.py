@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import qap_checkpoint
+
+failing = set()
+rendered = []
+
+
+def render_site(site, site_data, context):
+    if site in failing:
+        raise RuntimeError("render failed")
+    rendered.append(site)
+    output_path = os.path.join(context['output_dir'], f"{site}.docx")
+    with open(output_path, 'w') as f:
+        f.write(str(site_data))
+    return output_path
+
+
+def _cycle(workbook, output_dir):
+    # Site ids as read from a workbook column of numbers
+    sites = [(np.int64(site), {'value': site}) for site in range(1, 6)]
+    inputs = (workbook, 'C1', 'jane doe', output_dir)
+    prepared = []
+
+    def prepare(*args):
+        prepared.append(args)
+        return sites, {'output_dir': output_dir}, {'interpretation': None}
+
+    return inputs, prepare, prepared, qap_checkpoint.checkpoint_path(render_site, output_dir, 'C1')
+
+
+def _reset():
+    failing.clear()
+    rendered.clear()
+
+
+def test_no_checkpoint_unless_asked(workbook, output_dir):
+    _reset()
+    inputs, prepare, _, path = _cycle(workbook, output_dir)
+    result = qap_checkpoint.run_cycle(render_site, prepare, inputs, path)
+    assert len(result['outputs']) == 5
+    assert not os.path.exists(f"{path}.pkl")
+    assert not os.path.exists(f"{path}.journal")
+
+
+def test_resume_renders_only_the_missing_sites(workbook, output_dir):
+    _reset()
+    inputs, prepare, prepared, path = _cycle(workbook, output_dir)
+    failing.update({np.int64(3), np.int64(5)})
+    result = qap_checkpoint.run_cycle(render_site, prepare, inputs, path, checkpoint = True)
+    assert [site for site, _ in result['errors']] == [3, 5]
+    assert os.path.exists(f"{path}.pkl")
+    assert sorted(qap_checkpoint.load_journal(path)) == ['1', '2', '4']
+
+    _reset()
+    result = qap_checkpoint.run_cycle(render_site, prepare, inputs, path, resume = True)
+    assert len(prepared) == 1
+    assert rendered == [3, 5]
+    assert not result['errors']
+    assert [site for site, _ in result['outputs']] == [1, 2, 3, 4, 5]
+    assert not os.path.exists(f"{path}.pkl")
+
+
+def test_resume_rerenders_a_missing_report(workbook, output_dir):
+    _reset()
+    inputs, prepare, _, path = _cycle(workbook, output_dir)
+    failing.add(np.int64(5))
+    result = qap_checkpoint.run_cycle(render_site, prepare, inputs, path, checkpoint = True)
+    os.remove(dict(result['outputs'])[2])
+
+    _reset()
+    qap_checkpoint.run_cycle(render_site, prepare, inputs, path, resume = True)
+    assert rendered == [2, 5]
+
+
+def test_resume_with_other_settings_starts_over(workbook, output_dir):
+    _reset()
+    inputs, prepare, prepared, path = _cycle(workbook, output_dir)
+    failing.add(np.int64(5))
+    qap_checkpoint.run_cycle(render_site, prepare, inputs, path, checkpoint = True)
+
+    _reset()
+    qap_checkpoint.run_cycle(render_site, prepare, inputs[:3] + ('elsewhere',), path, resume = True)
+    assert len(prepared) == 2
+    assert rendered == [1, 2, 3, 4, 5]
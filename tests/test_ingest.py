@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import qap_ingest
+
+ANALYTES = ['na', 'k']
+
+
+def test_cache_round_trip(workbook, output_dir):
+    cache_dir = qap_ingest.cache_dir_for(output_dir)
+    first = qap_ingest.read_results(workbook, 'C1', ANALYTES, cache = True, cache_dir = cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    second = qap_ingest.read_results(workbook, 'C1', ANALYTES, cache = True, cache_dir = cache_dir)
+    assert second.equals(first)
+
+
+def test_unreadable_cache_file_warns(workbook, output_dir):
+    cache_dir = qap_ingest.cache_dir_for(output_dir)
+    first = qap_ingest.read_results(workbook, 'C1', ANALYTES, cache = True, cache_dir = cache_dir)
+    [name] = os.listdir(cache_dir)
+    with open(os.path.join(cache_dir, name), 'wb') as f:
+        f.write(b'not a cache file')
+    with pytest.warns(UserWarning, match = 'Ignoring unreadable cache file'):
+        again = qap_ingest.read_results(workbook, 'C1', ANALYTES, cache = True, cache_dir = cache_dir)
+    assert again.equals(first)
+
+
+def test_store_false_leaves_the_cache_alone(workbook, output_dir):
+    cache_dir = qap_ingest.cache_dir_for(output_dir)
+    qap_ingest.read_results(workbook, 'C1', ANALYTES, cache = True, cache_dir = cache_dir, store = False)
+    assert not os.path.exists(cache_dir)
+
+
+def test_nested_blocks_share_the_workbook(workbook):
+    with qap_ingest.open_workbook(workbook) as outer:
+        with qap_ingest.open_workbook(workbook) as inner:
+            assert inner is outer
+        # Still open for the outer block
+        assert qap_ingest.read_results(workbook, 'C1', ANALYTES, cache = False) is not None
+    assert not qap_ingest._workbooks
+
+
+def test_threads_read_one_open_workbook(workbook):
+    expected = {sheet: qap_ingest.read_results(workbook, sheet, ANALYTES, cache = False) for sheet in ('C1', 'I1')}
+    with qap_ingest.open_workbook(workbook):
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            sheets = ['C1', 'I1'] * 8
+            results = list(executor.map(lambda sheet: qap_ingest.read_results(workbook, sheet, ANALYTES, cache = False), sheets))
+    for sheet, result in zip(sheets, results):
+        assert result.equals(expected[sheet])
+    assert not qap_ingest._workbooks
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import qap_limits
+
+
+def _formatted(values, decimals):
+    decimals = np.broadcast_to(decimals, values.shape)
+    rounded = [float(f"{value:.{places}f}") for value, places in zip(values.ravel().tolist(), decimals.ravel().tolist())]
+    return np.array(rounded, dtype = float).reshape(values.shape)
+
+
+def _assert_same(values, decimals):
+    expected = _formatted(values, decimals)
+    actual = qap_limits._round_to(values, decimals)
+    np.testing.assert_array_equal(actual, expected)
+    # -0.0 and 0.0 compare equal, so check the signs too
+    assert np.array_equal(np.signbit(actual), np.signbit(expected))
+
+
+@pytest.mark.parametrize('places', [0, 1, 2, 3])
+def test_round_to_matches_formatting(places):
+    rng = np.random.default_rng(places)
+    values = np.concatenate([rng.normal(0, 1, 20000), rng.uniform(-500, 500, 20000), rng.lognormal(2, 2, 20000)])
+    _assert_same(values.reshape(-1, 4), places)
+
+
+@pytest.mark.parametrize('places', [0, 1, 2, 3])
+def test_round_to_matches_formatting_at_halves(places):
+    # Every half step and its neighbouring floats
+    halves = (np.arange(-20000, 20000) + 0.5) / 10.0 ** places
+    values = np.concatenate([halves, np.nextafter(halves, np.inf), np.nextafter(halves, -np.inf)])
+    _assert_same(values, places)
+
+
+def test_round_to_per_column_decimals():
+    values = np.array([[0.125, 2.675, 1.005, 0.05, np.inf], [-0.125, -2.675, 1.0049999, np.nan, -0.04]])
+    _assert_same(values, np.array([2, 2, 2, 1, 1]))
+
+
+def test_limit_ladder():
+    rules = {'pco2': {'threshold': 34, 'absolute': 2, 'relative': 0.06, 'decimals': 1},
+             'na': {'absolute': 3, 'decimals': 0}}
+    limits = qap_limits.alp_limits(rules, {'pco2': 30.0, 'na': 140.0})
+    assert limits == {'pco2': (28.0, 32.0), 'na': (137.0, 143.0)}
+    limits = qap_limits.alp_limits(rules, {'pco2': 50.0, 'na': 140.0})
+    assert limits['pco2'] == (47.0, 53.0)
@@ -0,0 +1,85 @@
+import importlib
+import os
+import docx
+import numpy as np
+import pandas as pd
+import pytest
+import qap_manifest
+import qap_templates
+
+rendered = []
+
+
+def render_site(site, site_data, context):
+    rendered.append(site)
+    output_path = os.path.join(context['output_dir'], f"{site}.docx")
+    with open(output_path, 'w') as f:
+        f.write(site_data.to_csv())
+    return output_path
+
+
+@pytest.fixture
+def cycle(tmp_path, output_dir):
+    template_path = str(tmp_path / 'template.docx')
+    docx.Document().save(template_path)
+    qap_templates.clear_templates()
+    # The manifest hashes the rendering modules' source
+    for name in qap_manifest.CODE_MODULES:
+        importlib.import_module(name)
+    rendered.clear()
+    # Site ids as read from a workbook column of numbers
+    sites = [(np.int64(site), pd.DataFrame({'result': [site * 1.5]})) for site in range(1, 5)]
+    context = {'output_dir': output_dir, 'sheet_name': 'C1', 'template_path': template_path, 'user_id': 'jane doe',
+               'chart_panels': [{'analyte': 'na', 'y': [1.0, 2.0], 'x': [0.1, 0.2]}]}
+    return sites, context
+
+
+def test_unchanged_sites_are_skipped(cycle):
+    sites, context = cycle
+    first = qap_manifest.render_changed(render_site, sites, context)
+    assert [reasons for _, reasons in first['changes']] == [['new site']] * 4
+
+    rendered.clear()
+    second = qap_manifest.render_changed(render_site, sites, context)
+    assert rendered == []
+    assert [site for site, _ in second['skipped']] == [1, 2, 3, 4]
+
+
+def test_missing_report_is_rendered_again(cycle):
+    sites, context = cycle
+    first = qap_manifest.render_changed(render_site, sites, context)
+    os.remove(dict(first['outputs'])[3])
+
+    rendered.clear()
+    second = qap_manifest.render_changed(render_site, sites, context)
+    assert rendered == [3]
+    assert second['changes'] == [(3, ['report missing'])]
+
+
+def test_changed_site_is_rendered_again(cycle):
+    sites, context = cycle
+    qap_manifest.render_changed(render_site, sites, context)
+
+    rendered.clear()
+    sites[1] = (sites[1][0], pd.DataFrame({'result': [9.9]}))
+    result = qap_manifest.render_changed(render_site, sites, context)
+    assert rendered == [2]
+    assert result['changes'] == [(2, ['site'])]
+
+
+def test_chart_jitter_is_not_a_change(cycle):
+    sites, context = cycle
+    qap_manifest.render_changed(render_site, sites, context)
+
+    rendered.clear()
+    context['chart_panels'][0]['x'] = [0.3, 0.4]
+    qap_manifest.render_changed(render_site, sites, context)
+    assert rendered == []
+
+
+def test_entries_of_other_sites_are_kept(cycle):
+    sites, context = cycle
+    qap_manifest.render_changed(render_site, sites, context)
+    qap_manifest.render_changed(render_site, sites[:2], context)
+    manifest = qap_manifest.load_manifest(qap_manifest.manifest_path(render_site, context))
+    assert sorted(manifest) == ['1', '2', '3', '4']
@@ -0,0 +1,40 @@
+import pytest
+import epoc_data_analysis
+import istat_data_analysis
+import lipids_data_analysis
+import qap_stats
+import wbcdiff_data_analysis
+
+PROGRAMS = [
+    (epoc_data_analysis, 'C1', 'Median'),
+    (istat_data_analysis, 'I1', 'Mean'),
+    (lipids_data_analysis, 'L1', 'Median'),
+    (wbcdiff_data_analysis, 'W1', 'Median'),
+]
+
+
+@pytest.mark.parametrize('program, sheet, label', PROGRAMS)
+def test_program_consensus_by_default(workbook, output_dir, program, sheet, label):
+    sites, context, report = program.prepare(workbook, sheet, 'jane doe', output_dir, consensus = 'program')
+    assert context['consensus_label'] == label
+    assert len(sites) == 25
+
+
+@pytest.mark.parametrize('program, sheet, label', PROGRAMS)
+def test_algorithm_a_consensus(workbook, output_dir, program, sheet, label):
+    sites, context, report = program.prepare(workbook, sheet, 'jane doe', output_dir, consensus = 'algorithm_a')
+    assert context['consensus_label'] == qap_stats.ALGORITHM_A_LABEL
+    consensus = report['interpretation']['consensus'].groupby(level = 'analyte', sort = False).first()
+    for analyte, value in consensus.items():
+        assert value == pytest.approx(report['robust_statistics'][analyte]['mean'], abs = 0.051)
+
+
+def test_wbcdiff_algorithm_a_differs_from_median(workbook, output_dir):
+    _, _, by_median = wbcdiff_data_analysis.prepare(workbook, 'W1', 'jane doe', output_dir, consensus = 'program')
+    _, _, robust = wbcdiff_data_analysis.prepare(workbook, 'W1', 'jane doe', output_dir, consensus = 'algorithm_a')
+    assert not by_median['interpretation']['consensus'].equals(robust['interpretation']['consensus'])
+
+
+def test_unknown_consensus_method(workbook, output_dir):
+    with pytest.raises(ValueError):
+        epoc_data_analysis.prepare(workbook, 'C1', 'jane doe', output_dir, consensus = 'mode')
@@ -0,0 +1,74 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import qap_service
+
+
+def _dirs(spool):
+    return [qap_service._spool(name, str(spool)) for name in ('incoming', 'working', 'done')]
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_claim_renames_job_with_owner(tmp_path):
+    job_id = qap_service.submit('epoc', 'book.xlsx', 'C1', 'jane doe', spool = str(tmp_path))
+    incoming, working, _ = _dirs(tmp_path)
+    path = qap_service._claim_next(incoming, working)
+    assert os.path.basename(path) == f"{job_id}@{socket.gethostname()}@{os.getpid()}.json"
+    assert qap_service._job_id(path) == job_id
+    assert os.listdir(incoming) == []
+    assert qap_service._claim_next(incoming, working) is None
+
+
+def test_claim_skips_jobs_that_vanish(tmp_path):
+    job_id = qap_service.submit('epoc', 'book.xlsx', 'C1', 'jane doe', spool = str(tmp_path))
+    incoming, working, _ = _dirs(tmp_path)
+    # Listed but gone by the time it is looked at, as when another worker
+    # claims it first
+    os.symlink(str(tmp_path / 'missing.json'), os.path.join(incoming, 'taken.json'))
+    path = qap_service._claim_next(incoming, working)
+    assert qap_service._job_id(path) == job_id
+
+
+def test_requeue_only_abandoned_claims(tmp_path):
+    incoming, working, _ = _dirs(tmp_path)
+    host = socket.gethostname()
+    claims = {
+        'live': f"live@{host}@{os.getppid()}.json",
+        'dead': f"dead@{host}@{_dead_pid()}.json",
+        'remote': "remote@elsewhere@1.json",
+        'stale': "stale@elsewhere@1.json",
+    }
+    for name in claims.values():
+        with open(os.path.join(working, name), 'w') as f:
+            f.write('{}')
+    old = time.time() - qap_service.stale_claim_seconds - 60
+    os.utime(os.path.join(working, claims['stale']), (old, old))
+
+    qap_service._requeue_abandoned(incoming, working)
+
+    assert sorted(os.listdir(incoming)) == ['dead.json', 'stale.json']
+    assert sorted(os.listdir(working)) == sorted([claims['live'], claims['remote']])
+
+
+def test_serve_once_reports_unreadable_job(tmp_path):
+    incoming, working, done = _dirs(tmp_path)
+    with open(os.path.join(incoming, 'broken.json'), 'w') as f:
+        f.write('{not json')
+    qap_service.serve(str(tmp_path), once = True)
+    with open(os.path.join(done, 'broken.json')) as f:
+        result = json.load(f)
+    assert result['error'].startswith('Unreadable job file')
+    assert os.listdir(working) == []
+
+
+def test_run_job_rejects_missing_keys():
+    result = qap_service.run_job({'id': 'x', 'program': 'epoc'})
+    assert result['error'] == "ValueError: Job is missing workbook, sheet, issuer"
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pytest
+import qap_batch
+import qap_stats
+import qap_tables
+from conftest import RESULTS, make_results
+
+ANALYTES = list(RESULTS['C1'])
+
+
+@pytest.fixture
+def results():
+    data = make_results(RESULTS['C1'], sites = 60)
+    # A few gross errors and missing results
+    data.loc[3, 'na'] = 160
+    data.loc[7, 'k'] = 9.1
+    data.loc[11, 'glu'] = np.nan
+    data.loc[20, 'ph'] = 6.9
+    return data
+
+
+def _cascade_loop(data, analytes):
+    # The exclusion as it was written before inlier_mask(): one analyte at a
+    # time, each against the fences of the rows the previous ones left
+    for analyte in analytes:
+        bounds = qap_stats.outlier_bounds(data, [analyte])[analyte]
+        data = data[(data[analyte] >= bounds['lower']) & (data[analyte] <= bounds['upper'])]
+    return data
+
+
+def _algorithm_a(values):
+    # ISO 13528 C.3, one analyte at a time
+    values = values[~np.isnan(values)]
+    mean = np.median(values)
+    sd = 1.483 * np.median(np.abs(values - mean))
+    for _ in range(qap_stats.ALGORITHM_A_MAX_ITERATIONS):
+        winsorized = np.clip(values, mean - 1.5 * sd, mean + 1.5 * sd)
+        new_mean = winsorized.mean()
+        new_sd = 1.134 * winsorized.std(ddof = 1)
+        if abs(new_mean - mean) <= 1e-6 * abs(mean) and abs(new_sd - sd) <= 1e-6 * abs(sd):
+            return new_mean, new_sd
+        mean, sd = new_mean, new_sd
+    return mean, sd
+
+
+def test_site_rows_returns_duplicates_quietly(capsys):
+    data = pd.DataFrame({'site': ['A', 'B', 'A', None, 'A'], 'na': [1.0, 2.0, 3.0, 4.0, 5.0]})
+    rows, duplicates = qap_stats.site_rows(data, keep = 'last')
+    assert list(rows.index) == ['B', 'A']
+    assert rows.loc['A', 'na'] == 5.0
+    assert duplicates == {'A': 3}
+    assert capsys.readouterr().out == ''
+
+
+def test_cascade_matches_the_loop(results):
+    expected = _cascade_loop(results, ANALYTES)
+    cleaned = qap_stats.remove_outliers(results, ANALYTES, 'cascade')
+    assert list(cleaned.index) == list(expected.index)
+    assert 3 not in cleaned.index and 11 not in cleaned.index
+
+
+def test_independent_blanks_only_the_outlying_result(results):
+    cleaned = qap_stats.remove_outliers(results, ANALYTES, 'independent')
+    assert len(cleaned) == len(results)
+    assert np.isnan(cleaned.loc[3, 'na'])
+    assert cleaned.loc[3, 'k'] == results.loc[3, 'k']
+    mask = qap_stats.inlier_mask(results, ANALYTES, 'independent')
+    assert mask.sum() < mask.size
+    assert not mask[11, ANALYTES.index('glu')]
+
+
+def test_unknown_exclusion_mode(results):
+    with pytest.raises(ValueError):
+        qap_stats.inlier_mask(results, ANALYTES, 'neither')
+
+
+def test_algorithm_a_matches_the_reference(results):
+    statistics = qap_stats.algorithm_a(results, ANALYTES)
+    for analyte in ANALYTES:
+        mean, sd = _algorithm_a(results[analyte].to_numpy(dtype = float))
+        assert statistics[analyte]['mean'] == pytest.approx(mean, rel = 1e-5)
+        assert statistics[analyte]['sd'] == pytest.approx(sd, rel = 1e-5)
+    assert statistics['glu']['n'] == 59
+
+
+def test_algorithm_a_resists_a_gross_error(results):
+    statistics = qap_stats.algorithm_a(results, ['na'])['na']
+    clean = results['na'].drop(3).mean()
+    assert abs(statistics['mean'] - clean) < abs(results['na'].mean() - clean) / 2
+
+
+def test_algorithm_a_without_spread():
+    data = pd.DataFrame({'one': [np.nan, 5.0, np.nan], 'flat': [4.0, 4.0, 4.0], 'none': [np.nan] * 3})
+    statistics = qap_stats.algorithm_a(data, ['one', 'flat', 'none'])
+    assert statistics['one']['mean'] == 5.0 and np.isnan(statistics['one']['sd'])
+    assert statistics['flat']['mean'] == 4.0 and np.isnan(statistics['flat']['sd'])
+    assert np.isnan(statistics['none']['mean']) and statistics['none']['n'] == 0
+
+
+def test_z_scores_use_the_robust_statistics(results):
+    rows, _ = qap_stats.site_rows(results)
+    statistics = qap_stats.algorithm_a(results, ANALYTES)
+    statistics['ph']['sd'] = np.nan
+    consensus = {analyte: 0.0 for analyte in ANALYTES}
+    matrix = qap_stats.interpretation_matrix(rows[ANALYTES], consensus, consensus, consensus, robust_statistics = statistics)
+    na = matrix.xs('na', level = 'analyte')
+    expected = (rows['na'] - statistics['na']['mean']) / statistics['na']['sd']
+    np.testing.assert_allclose(na['z_score'].to_numpy(), expected.to_numpy())
+    assert matrix.xs('ph', level = 'analyte')['z_score'].isna().all()
+    assert np.isnan(matrix.loc[(results.loc[11, 'site'], 'glu'), 'z_score'])
+
+
+def test_z_score_column_and_signals():
+    header, rows = qap_tables.with_z_scores(['Analyte', 'Your Result', 'Interpretation'],
+                                            [['Na', '140', 'Acceptable'], ['K', '', 'Unacceptable']], [0.456, np.nan])
+    assert header == ['Analyte', 'Your Result', qap_tables.Z_SCORE_HEADER, 'Interpretation']
+    assert rows == [['Na', '140', '0.46', 'Acceptable'], ['K', '', '', 'Unacceptable']]
+    interpretation = pd.DataFrame({'z_score': [0.5, -2.5, 2.0, 3.0, -4.2, np.nan]})
+    assert qap_batch.z_signals(interpretation) == (1, 2)
+    assert qap_batch.z_signals(pd.DataFrame({'result': [1.0]})) == (0, 0)
@@ -1,20 +1,69 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.oxml import OxmlElement
+from docx.shared import Inches, Pt
 from docx.oxml.ns import qn
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_TABLE_ALIGNMENT
 import os
 from datetime import datetime
-import gui
+import uuid
+import qap_charts
+import qap_checkpoint
+import qap_ingest
+import qap_limits
+import qap_stats
+import qap_tables
+import qap_templates
 import math
 
+# Set by the GUI, which then calls run() without arguments
 file_path = ""
 sheet_name = ""
 user_id = ""
+workers = 1
+
+OUTPUT_DIR = r"C:\iCCnet QAP Program\Output\POCT"
+TEMPLATE_PATH = r"C:\iCCnet QAP Program\Source_files\WBCWordTemplate.docx"
+
+ANALYTES = ['wcc', 'neut', 'lymph', 'mono', 'eosino', 'baso']
+
+ALP_RULES = {
+    'wcc': {'threshold': 5, 'absolute': 0.5, 'relative': 0.1, 'decimals': 1},
+    'neut': {'threshold': 10, 'absolute': 1, 'relative': 0.1, 'decimals': 1},
+    'lymph': {'threshold': 10, 'absolute': 2, 'relative': 0.2, 'decimals': 1},
+    'mono': {'threshold': 10, 'absolute': 3, 'relative': 0.3, 'decimals': 1},
+    'eosino': {'threshold': 10, 'absolute': 3, 'relative': 0.3, 'decimals': 1},
+    'baso': {'threshold': 10, 'absolute': 3, 'relative': 0.3, 'decimals': 1}
+}
+
+additional_text = {
+    'wcc': 'RCPA ALP: +/- 0.5 up to 5x10⁹/L\nthen 10%',
+    'neut': 'RCPA ALP: +/- 1 up to 10%\nthen 10%',
+    'lymph': 'RCPA ALP: +/- 2 up to 10%\nthen 20%',
+    'mono': 'RCPA ALP: +/- 3 up to 10%\nthen 30%',
+    'eosino': 'RCPA ALP: +/- 3 up to 10%\nthen 30%',
+    'baso': 'RCPA ALP: +/- 3 up to 10%\nthen 30%'
+}
+
+CHART_STYLE = {
+    'grid': (2, 3),
+    'figsize': (25, 14),
+    'pad': 10.0,
+    'h_pad': 8,
+    'point_size': 10,
+    'point_alpha': None,
+    'marker_size': 105,
+    'title_size': 25,
+    'xlabel_size': 24,
+    'ylabel_size': 20,
+    'legend_size': 16,
+    'legend_anchor': (1.15, 0),
+    'note_size': 12,
+    'note_xy': (0, -0.16),
+    'tick_size': 20,
+    'embed_width': 7,
+    'dpi': 200,
+}
 
 
 def custom_round(value, decimal_places = 1):
@@ -22,44 +71,160 @@ def custom_round(value, decimal_places = 1):
     return math.floor(value * multiplier + 0.5) / multiplier
 
 
-def replace_text(doc, search_text, replace_text):
-    for paragraph in doc.paragraphs:
-        if search_text in paragraph.text:
-            paragraph.text = paragraph.text.replace(search_text, replace_text)
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                if search_text in cell.text:
-                    cell.text = cell.text.replace(search_text, replace_text)
-
-def replace_placeholder_in_footer(doc, placeholder, replacement_text):
-    for section in doc.sections:
-        for paragraph in section.footer.paragraphs:
-            if placeholder in paragraph.text:
-                paragraph.text = paragraph.text.replace(placeholder, replacement_text)
-                for run in paragraph.runs:
-                    if replacement_text in run.text:
-                        run.font.size = Pt(7)
-                        run.font.bold = False
-
-
-def run():
-    global file_path, sheet_name, user_id
-
+def chart_panels(bloodcells, bloodcell_full_names, bloodcell_units, consensus, limits, Database):
+    panels = []
+    for bloodcell in bloodcells:
+        if bloodcell == 'wcc':
+            other_sites_data = Database[bloodcell].dropna()
+            panels.append({
+                'x': np.linspace(0.8, 1.2, len(other_sites_data)),
+                'y': other_sites_data.values,
+                'ylim': (Database[bloodcell].min() - 4, Database[bloodcell].max() + 4),
+                'bands': (limits[bloodcell][0], consensus[bloodcell], limits[bloodcell][1]),
+                'xlabel': bloodcell_full_names[bloodcell],
+                'xlabel_size': 20,
+                'ylabel': bloodcell_units[bloodcell],
+                'ylabel_size': 18,
+                'note': additional_text[bloodcell],
+            })
+        else:
+            other_sites_data = Database[bloodcell + '_percent'].dropna()
+
+            if bloodcell == 'eosino' or bloodcell == 'baso' or bloodcell == 'mono':
+                data_min = Database[bloodcell + '_percent'].min()
+                data_max = Database[bloodcell + '_percent'].max()
+                padding = (data_max - data_min) * 3
+            else:
+                data_min = Database[bloodcell + '_percent'].min()
+                data_max = Database[bloodcell + '_percent'].max()
+                padding = (data_max - data_min) * 0.8
+
+            min_val = max(data_min - padding, 0)
+            max_val = data_max + padding
+
+            panels.append({
+                'x': np.linspace(0.8, 1.2, len(other_sites_data)),
+                'y': other_sites_data.values,
+                'ylim': (min_val, max_val),
+                'bands': (limits[bloodcell][0], consensus[bloodcell], limits[bloodcell][1]),
+                'xlabel': bloodcell_full_names[bloodcell],
+                'ylabel': bloodcell_units[bloodcell],
+                'note': additional_text[bloodcell],
+            })
+    return panels
+
+
+def render_site(site, interpretation, context):
+    sheet_name = context['sheet_name']
+    user_id = context['user_id']
+    template_path = context['template_path']
+    bloodcell_full_names = context['bloodcell_full_names']
+    bloodcell_units = context['bloodcell_units']
+    print(f"Processing site: {site}")
+
+    today_date = datetime.now().strftime('%d/%m/%Y')
+    doc = qap_templates.fill_template(template_path, {
+        'DATE': today_date,
+        'SITE': site,
+        'CYCLE': sheet_name,
+        'ISSUER': user_id.title(),
+    }, fonts = {'ISSUER': {'size': Pt(7), 'bold': False}})
+
+    program_paragraph = doc.add_paragraph()
+    run = program_paragraph.add_run("Program: White Blood Cell Differential")
+    run.bold = True
+    program_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    device_paragraph = doc.add_paragraph()
+    run = device_paragraph.add_run("Device: HemoCue WBC Diff")
+    run.bold = True
+    device_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    site_paragraph = doc.add_paragraph()
+    run = site_paragraph.add_run(site)
+    run.bold = True
+    site_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    sample_paragraph = doc.add_paragraph()
+    run = sample_paragraph.add_run(f"Sample: {sheet_name}")
+    run.bold = True
+    sample_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+    rows = []
+    for entry in interpretation.itertuples():
+        bloodcell = entry.Index
+        if bloodcell == 'wcc':
+            result = 'No submission' if pd.isna(entry.result) else "{:.1f}".format(round(entry.result, 1))
+            lower_limit = "{:.1f}".format(round(entry.lower_limit, 1))
+            consensus = "{:.1f}".format(round(entry.consensus, 1))
+            upper_limit = "{:.1f}".format(round(entry.upper_limit, 1))
+        else:
+            result = 'No submission' if pd.isna(entry.result) else str(entry.result)
+            lower_limit = str(round(entry.lower_limit, 1))
+            consensus = str(round(entry.consensus, 1))
+            upper_limit = str(round(entry.upper_limit, 1))
+        rows.append([
+            bloodcell_full_names[bloodcell],
+            result,
+            lower_limit,
+            consensus,
+            upper_limit,
+            bloodcell_units[bloodcell],
+            entry.verdict,
+        ])
+
+    header = ['Blood Cell', 'Your Result', 'Lower Limit', context['consensus_label'], 'Upper Limit', 'Units', 'Interpretation']
+    if context['z_scores']:
+        header, rows = qap_tables.with_z_scores(header, rows, interpretation['z_score'])
+    qap_tables.add_results_table(doc, header, rows)
+
+    doc.add_paragraph()
+
+    markers = []
+    for entry in interpretation.itertuples():
+        markers.append((1, entry.result, entry.verdict == 'Acceptable'))
+
+    chart = qap_charts.site_chart(context['cycle_key'], context['chart_panels'], CHART_STYLE, markers)
+
+    graph_table = doc.add_table(rows=1, cols=1)
+    graph_table.alignment = WD_TABLE_ALIGNMENT.LEFT
+    cell = graph_table.cell(0, 0)
+    paragraph = cell.paragraphs[0]
+    run = paragraph.add_run()
+    run.add_picture(chart, width = Inches(CHART_STYLE['embed_width']))
+
+    today_date = datetime.now().strftime('%d-%m-%Y')
+    output_path = os.path.join(context['output_dir'], f"WBC_{site}_{sheet_name}_{today_date}.docx")
+    doc.save(output_path)
+
+    return output_path
+
+
+def prepare(file_path, sheet_name, user_id, output_dir = OUTPUT_DIR, template_path = TEMPLATE_PATH, consensus = None, exclusion = None, z_scores = None):
+    """Read and judge one cycle sheet.
+
+    Returns (sites, context, report): the per-site interpretations and the
+    cycle context for render_site, and the report entries of the cycle.
+    consensus, exclusion and z_scores left as None fall back to
+    qap_stats.consensus_method, qap_stats.exclusion_mode and
+    qap_tables.show_z_scores. No outliers are excluded from
+    differentials, so exclusion has no effect here.
+    """
     if not file_path:
         raise FileNotFoundError("No file path specified.")
     if not sheet_name:
         raise ValueError("No sheet name specified.")
     if not user_id:
         raise ValueError("No user ID specified.")
+    consensus = qap_stats.consensus_method if consensus is None else consensus
+    z_scores = qap_tables.show_z_scores if z_scores is None else z_scores
+    if consensus not in qap_stats.CONSENSUS_METHODS:
+        raise ValueError(f"Unknown consensus method: {consensus}")
     
 
-    Database = pd.read_excel(file_path, sheet_name = sheet_name)
-    template_path = r"C:\iCCnet QAP Program\Source_files\WBCWordTemplate.docx"
-
-    Database.columns = Database.columns.str.strip()
-
-    bloodcells = ['wcc', 'neut', 'lymph', 'mono', 'eosino', 'baso']
+    bloodcells = list(ANALYTES)
+    Database = qap_ingest.read_results(file_path, sheet_name, bloodcells, cache_dir = qap_ingest.cache_dir_for(output_dir))
 
     bloodcell_full_names = {
         'wcc': 'WCC',
@@ -79,10 +244,6 @@ def run():
         'baso': '%'
     }
 
-    for bloodcell in bloodcells:
-        Database[bloodcell] = pd.to_numeric(Database[bloodcell], errors='coerce')
-
-
     for bloodcell in bloodcells[1:]:
         Database[bloodcell + '_percent'] = (Database[bloodcell] / Database['wcc']) * 100
     
@@ -92,270 +253,92 @@ def run():
     medians_percent = {bloodcell + '_percent': custom_round(np.median(Database[bloodcell + '_percent'].dropna()), 1) for bloodcell in bloodcells[1:]}
 
 
-    limits = {}
-    for bloodcell, median in medians.items():
-        if bloodcell == 'wcc':
-            if median < 5.1:
-                ll = float(f"{median - 0.5:.1f}")
-                ul = float(f"{median + 0.5:.1f}")
-            else: 
-                ll = float(f"{median * 0.9:.1f}")
-                ul = float(f"{median * 1.1:.1f}")
-        limits[bloodcell] = (ll, ul)
-
-    for bloodcell, median in medians_percent.items():
-        if bloodcell == 'neut_percent':
-            if median < 10.1:
-                ll = float(f"{median - 1:.1f}")
-                ul = float(f"{median + 1:.1f}")
-            else: 
-                ll = float(f"{median * 0.9:.1f}")
-                ul = float(f"{median * 1.1:.1f}")
-        elif bloodcell == 'lymph_percent':
-            if median < 10.1:
-                ll = float(f"{median - 2:.1f}")
-                ul = float(f"{median + 2:.1f}")
-            else:
-                ll = float(f"{median * 0.8:.1f}")
-                ul = float(f"{median * 1.2:.1f}")
-        elif bloodcell == 'mono_percent':
-            if median < 10.1:
-                ll = float(f"{median - 3:.1f}")
-                ul = float(f"{median + 3:.1f}")
-            else:
-                ll = float(f"{median * 0.7:.1f}")
-                ul = float(f"{median * 1.3:.1f}")
-        elif bloodcell == 'eosino_percent':
-            if median < 10.1:
-                ll = float(f"{median - 3:.1f}")
-                ul = float(f"{median + 3:.1f}")
-            else:
-                ll = float(f"{median * 0.7:.1f}")
-                ul = float(f"{median * 1.3:.1f}")
-        elif bloodcell == 'baso_percent':
-            if median < 10.1:
-                ll = float(f"{median - 3:.1f}")
-                ul = float(f"{median + 3:.1f}")
-            else:
-                ll = float(f"{median * 0.7:.1f}")
-                ul = float(f"{median * 1.3:.1f}")
-        limits[bloodcell] = (ll, ul)
-
-    for index, row in Database.iterrows():
-        site = row['site']
-        print(f"Processing site: {site}")
-
-        if pd.isnull(site):
-            continue
-
-        doc = Document(template_path)
-
-        today_date = datetime.now().strftime('%d/%m/%Y')
-        replace_text(doc, 'DATE', today_date)
-        replace_text(doc, 'SITE', site)
-        replace_text(doc, 'CYCLE', sheet_name)
-        replace_placeholder_in_footer(doc, 'ISSUER', user_id.title())
-
-        program_paragraph = doc.add_paragraph()
-        run = program_paragraph.add_run("Program: White Blood Cell Differential")
-        run.bold = True
-        program_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        device_paragraph = doc.add_paragraph()
-        run = device_paragraph.add_run("Device: HemoCue WBC Diff")
-        run.bold = True
-        device_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        site_paragraph = doc.add_paragraph()
-        run = site_paragraph.add_run(site)
-        run.bold = True
-        site_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-        sample_paragraph = doc.add_paragraph()
-        run = sample_paragraph.add_run(f"Sample: {sheet_name}")
-        run.bold = True
-        sample_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-
-        table = doc.add_table(rows = 1, cols = 7)
-
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Blood Cell'
-        hdr_cells[1].text = 'Your Result'
-        hdr_cells[2].text = 'Lower Limit'
-        hdr_cells[3].text = 'Median'
-        hdr_cells[4].text = 'Upper Limit'
-        hdr_cells[5].text = 'Units'
-        hdr_cells[6].text = 'Interpretation'
-
-        for cell in hdr_cells:
-            cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            if not cell.paragraphs[0].runs:
-                cell.paragraphs[0].add_run()
-            run = cell.paragraphs[0].runs[0]
-            run.font.size = Pt(12)
-            run.font.bold = True
-            run.font.color.rgb = RGBColor(255, 255, 255)
-            shading = OxmlElement('w:shd')
-            shading.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}fill', '800000')
-            cell._element.get_or_add_tcPr().append(shading)
-
-        #TABLE
-        for i, bloodcell in enumerate(bloodcells):
-            row_cells = table.add_row().cells
-            bloodcell_run = row_cells[0].paragraphs[0].add_run(bloodcell_full_names[bloodcell])  
-            bloodcell_run.font.bold = True
-            your_result = row[bloodcell]
- 
-            if pd.isna(your_result):
-                # No submission case
-                if bloodcell == 'wcc':
-                    row_cells[1].text = 'No submission'
-                    row_cells[2].text = "{:.1f}".format(limits[bloodcell][0])
-                    row_cells[3].text = "{:.1f}".format(medians[bloodcell])
-                    row_cells[4].text = "{:.1f}".format(limits[bloodcell][1])
-                    row_cells[5].text = bloodcell_units[bloodcell]
-                else:
-                    row_cells[1].text = 'No submission'
-                    row_cells[2].text = str(round(limits[bloodcell + '_percent'][0], 1))
-                    row_cells[3].text = str(round(medians_percent[bloodcell + '_percent'], 1))
-                    row_cells[4].text = str(round(limits[bloodcell + '_percent'][1], 1))
-                    row_cells[5].text = bloodcell_units[bloodcell]
-                row_cells[6].text = 'Unacceptable'
-            else:
-                # Is a submission
-                if bloodcell == 'wcc':
-                    row_cells[1].text = "{:.1f}".format(round(your_result, 1))
-                    row_cells[2].text = "{:.1f}".format(round(limits[bloodcell][0], 1))
-                    row_cells[3].text = "{:.1f}".format(round(medians[bloodcell], 1))
-                    row_cells[4].text = "{:.1f}".format(round(limits[bloodcell][1], 1))
-                    row_cells[5].text = bloodcell_units[bloodcell]
-            
-                    if limits[bloodcell][0] <= your_result <= limits[bloodcell][1]:
-                        row_cells[6].text = 'Acceptable'
-                    else:
-                        row_cells[6].text = 'Unacceptable'
-                else:
-                    your_result_percent = round((your_result / row['wcc']) * 100, 1)
-                    row_cells[1].text = str(your_result_percent)
-                    row_cells[2].text = str(round(limits[bloodcell + '_percent'][0], 1))
-                    row_cells[3].text = str(round(medians_percent[bloodcell + '_percent'], 1))
-                    row_cells[4].text = str(round(limits[bloodcell + '_percent'][1], 1))
-                    row_cells[5].text = bloodcell_units[bloodcell]
-            
-                    if limits[bloodcell + '_percent'][0] <= your_result_percent <= limits[bloodcell + '_percent'][1]:
-                        row_cells[6].text = 'Acceptable'
-                    else:
-                        row_cells[6].text = 'Unacceptable'
-
-
-            for cell in row_cells:
-                cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-                if not cell.paragraphs[0].runs:
-                    cell.paragraphs[0].add_run()
-                run = cell.paragraphs[0].runs[0]
-                run.font.size = Pt(10)
-                run.font.color.rgb = RGBColor(0, 0, 0)
-                shading = OxmlElement('w:shd')
-                if i % 2 == 0:
-                    shading.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}fill', 'FCF7EC')
-                else:
-                    shading.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}fill', 'FFFFFF')
-                cell._element.get_or_add_tcPr().append(shading)
-
-        doc.add_paragraph()
-
-        fig, axes = plt.subplots(2, 3, figsize = (25, 14))
-        fig.tight_layout(pad = 10.0, h_pad = 8)
-        axes = axes.flatten()
-
-        for idx, bloodcell in enumerate(bloodcells):  
-            ax = axes[idx]
-
-            if bloodcell == 'wcc':
-                your_result_wcc = row[bloodcell]
-                other_sites_data = Database[bloodcell].dropna()
-                other_sites_data = other_sites_data[other_sites_data != your_result_wcc]
-
-                x_positions = np.linspace(0.8, 1.2, len(other_sites_data))
-                ax.plot(x_positions, other_sites_data, 'o', color = 'black', label = "Other sites", markersize = 10)
-                ax.scatter(1, your_result_wcc, color = 'fuchsia', marker = 's', label = 'Your result', s = 105, zorder = 2)
-                ax.set_ylim(Database[bloodcell].min() - 4, Database[bloodcell].max() + 4)
-                ax.set_ylabel(bloodcell_units[bloodcell], fontsize = 18)
-                ax.set_xlabel(bloodcell_full_names[bloodcell], fontsize = 20, fontweight = 'bold', loc = 'left')
-
-                ax.axhspan(limits[bloodcell][0], medians[bloodcell], color = 'green', alpha = 0.2)
-                ax.axhspan(medians[bloodcell], limits[bloodcell][1], color = 'green', alpha = 0.2)
-
-                if limits[bloodcell][0] <= your_result_wcc <= limits[bloodcell][1]:
-                    ax.set_title('Acceptable', fontsize = 25, fontweight = 'bold', color = 'green')
-                else:
-                    ax.set_title('Unacceptable', fontsize = 25, fontweight = 'bold', color = 'red')
-
-                ax.annotate('RCPA ALP: +/- 0.5 up to 5x10⁹/L\nthen 10%', xy = (0, -0.16), xycoords = 'axes fraction', fontsize = 12, ha = 'left')
+    consensus_values = {'wcc': medians['wcc']}
+    for bloodcell in bloodcells[1:]:
+        consensus_values[bloodcell] = medians_percent[bloodcell + '_percent']
+    consensus_label = 'Median'
+
+    # Differentials are judged as percentages, so that is what their robust
+    # statistics are taken over
+    robust_statistics = qap_stats.algorithm_a(Database, ['wcc'] + [bloodcell + '_percent' for bloodcell in bloodcells[1:]])
+    robust_statistics = {bloodcell: robust_statistics[bloodcell if bloodcell == 'wcc' else bloodcell + '_percent'] for bloodcell in bloodcells}
+    if consensus == 'algorithm_a':
+        consensus_values = {bloodcell: custom_round(robust_statistics[bloodcell]['mean'], 1) for bloodcell in bloodcells}
+        consensus_label = qap_stats.ALGORITHM_A_LABEL
+
+    limits = qap_limits.alp_limits(ALP_RULES, consensus_values)
+
+    # A site entered twice is reported from its last row.
+    # Differentials are judged on the percentage as printed, to one decimal.
+    site_rows, duplicate_sites = qap_stats.site_rows(Database, keep = 'last')
+    results = pd.DataFrame({'wcc': site_rows['wcc']})
+    for bloodcell in bloodcells[1:]:
+        results[bloodcell] = site_rows[bloodcell + '_percent'].round(1)
+
+    interpretation = qap_stats.interpretation_matrix(
+        results,
+        consensus_values,
+        {bloodcell: limits[bloodcell][0] for bloodcell in bloodcells},
+        {bloodcell: limits[bloodcell][1] for bloodcell in bloodcells},
+        robust_statistics = robust_statistics,
+    )
+
+    context = {
+        'cycle_key': uuid.uuid4().hex,
+        'chart_panels': chart_panels(bloodcells, bloodcell_full_names, bloodcell_units, consensus_values, limits, Database),
+        'sheet_name': sheet_name,
+        'user_id': user_id,
+        'template_path': template_path,
+        'output_dir': output_dir,
+        'bloodcell_full_names': bloodcell_full_names,
+        'bloodcell_units': bloodcell_units,
+        'consensus_label': consensus_label,
+        'z_scores': z_scores,
+    }
 
-            else:
-                your_result_percent = (row[bloodcell] / row['wcc']) * 100
-                other_sites_data = Database[bloodcell + '_percent'].dropna()
-                other_sites_data = other_sites_data[other_sites_data != your_result_percent]
-
-                x_positions = np.linspace(0.8, 1.2, len(other_sites_data))
-                ax.plot(x_positions, other_sites_data, 'o', color = 'black', label = "Other sites", markersize = 10)
-
-                ax.scatter(1, your_result_percent, color = 'fuchsia', marker = 's', label = 'Your result', s = 105, zorder = 2)
-
-                if bloodcell == 'eosino' or bloodcell == 'baso' or bloodcell == 'mono':
-                    data_min = Database[bloodcell + '_percent'].min()
-                    data_max = Database[bloodcell + '_percent'].max()
-                    padding = (data_max - data_min) * 3  
-                else:
-                    data_min = Database[bloodcell + '_percent'].min()
-                    data_max = Database[bloodcell + '_percent'].max()
-                    padding = (data_max - data_min) * 0.8  
-
-                min_val = max(data_min - padding, 0)
-                max_val = data_max + padding
-
-                ax.set_ylim(min_val, max_val)
-                ax.set_ylabel(bloodcell_units[bloodcell], fontsize = 20)
-                ax.set_xlabel(bloodcell_full_names[bloodcell], fontsize = 24, fontweight = 'bold', loc = 'left')
-
-                ax.axhspan(limits[bloodcell + '_percent'][0], medians_percent[bloodcell + '_percent'], color = 'green', alpha = 0.2)
-                ax.axhspan(medians_percent[bloodcell + '_percent'], limits[bloodcell + '_percent'][1], color = 'green', alpha = 0.2)
-
-                if limits[bloodcell + '_percent'][0] <= your_result_percent <= limits[bloodcell + '_percent'][1]:
-                    ax.set_title('Acceptable', fontsize = 25, fontweight = 'bold', color = 'green')
-                else:
-                    ax.set_title('Unacceptable', fontsize = 25, fontweight = 'bold', color = 'red')
-
-
-                additional_text = {
-                    'neut': 'RCPA ALP: +/- 1 up to 10%\nthen 10%',
-                    'lymph': 'RCPA ALP: +/- 2 up to 10%\nthen 20%',
-                    'mono': 'RCPA ALP: +/- 3 up to 10%\nthen 30%',
-                    'eosino': 'RCPA ALP: +/- 3 up to 10%\nthen 30%',
-                    'baso': 'RCPA ALP: +/- 3 up to 10%\nthen 30%'
-                }
-                ax.annotate(additional_text[bloodcell], xy = (0, -0.16), xycoords='axes fraction', fontsize = 12, ha = 'left')
-
-            ax.legend(loc = 'upper right', bbox_to_anchor = (1.15, 0), fontsize = 16)
-            ax.set_xticks([])
-            ax.tick_params(axis='y', labelsize = 20)
-
-        output_dir = r"C:\iCCnet QAP Program\Output\POCT"
-        plot_filename = os.path.join(output_dir, f'{site}_combined.png')
-        plt.savefig(plot_filename, bbox_inches='tight')
-        plt.close()
-
-        graph_table = doc.add_table(rows=1, cols=1)
-        graph_table.alignment = WD_TABLE_ALIGNMENT.LEFT
-        cell = graph_table.cell(0, 0)
-        paragraph = cell.paragraphs[0]
-        run = paragraph.add_run()
-        run.add_picture(plot_filename, width=Inches(7))
-
-        os.remove(plot_filename)
-
-        today_date = datetime.now().strftime('%d-%m-%Y')
-        output_path = os.path.join(output_dir, f"WBC_{site}_{sheet_name}_{today_date}.docx")
-        doc.save(output_path)
+    sites = qap_stats.site_interpretations(interpretation)
+
+    report = {
+        'robust_statistics': robust_statistics,
+        'interpretation': interpretation,
+        'duplicate_sites': duplicate_sites,
+    }
+    return sites, context, report
+
+
+def run(file_path = None, sheet_name = None, user_id = None, output_dir = OUTPUT_DIR, template_path = TEMPLATE_PATH, workers = None, incremental = False, resume = False, checkpoint = False, consensus = None, exclusion = None, z_scores = None):
+    """Generate the reports of every site in one cycle sheet.
+
+    Arguments left as None fall back to the module globals of the same name.
+    Returns a dict with the rendered 'outputs', the per-site 'errors' and the
+    cycle's interpretation. incremental = True renders only the sites whose
+    report inputs changed since the last run (see qap_manifest); checkpoint =
+    True records the run's progress and resume = True carries on from where
+    an interrupted run stopped (see qap_checkpoint).
+    consensus, exclusion and z_scores are passed on to prepare().
+    """
+    settings = globals()
+    consensus = qap_stats.consensus_method if consensus is None else consensus
+    exclusion = qap_stats.exclusion_mode if exclusion is None else exclusion
+    z_scores = qap_tables.show_z_scores if z_scores is None else z_scores
+    sheet_name = settings['sheet_name'] if sheet_name is None else sheet_name
+    inputs = (
+        settings['file_path'] if file_path is None else file_path,
+        sheet_name,
+        settings['user_id'] if user_id is None else user_id,
+        output_dir,
+        template_path,
+        consensus,
+        exclusion,
+        z_scores,
+    )
+    return qap_checkpoint.run_cycle(
+        render_site,
+        prepare,
+        inputs,
+        qap_checkpoint.checkpoint_path(render_site, output_dir, sheet_name),
+        workers = settings['workers'] if workers is None else workers,
+        incremental = incremental,
+        resume = resume,
+        checkpoint = checkpoint,
+    )